@@ -0,0 +1,281 @@
+"""Local stand-ins for Spotify, a newznab indexer and SABnzbd used by the benchmark harness.
+
+Every fake is a small threaded HTTP server on 127.0.0.1 that answers just the
+requests SoundSeeker sends, optionally after an artificial latency, and
+counts the requests it received.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+
+PAGE_SIZE = 100
+TRACK_DURATION_MS = 200000
+FORMAT_BYTES_PER_SECOND = {"flac": 110000, "mp3": 40000}
+
+class FakeServer:
+    """Runs a handler method per request path on a background ThreadingHTTPServer."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake._dispatch(self)
+
+            def do_POST(self):
+                fake._dispatch(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def total_requests(self):
+        with self._lock:
+            return sum(self.requests.values())
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _dispatch(self, request):
+        parts = urlsplit(request.path)
+        params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        if request.command == "POST":
+            length = int(request.headers.get("Content-Length") or 0)
+            params.update({key: values[-1] for key, values in parse_qs(request.rfile.read(length).decode()).items()})
+        with self._lock:
+            self.requests[self.request_kind(parts.path, params)] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        status, content_type, body = self.handle(request.command, parts.path, params)
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def request_kind(self, path, params):
+        return path
+
+    def handle(self, method, path, params):
+        raise NotImplementedError
+
+    @staticmethod
+    def json(data, status=200):
+        return status, "application/json", json.dumps(data).encode()
+
+def synthetic_track(index):
+    return {
+        'id': f"bench{index:06d}",
+        'name': f"Track {index}",
+        'artists': [{'name': f"Artist {index % 97}"}],
+        'duration_ms': TRACK_DURATION_MS,
+    }
+
+def synthetic_playlists(tracks, playlists, overlap=0.0):
+    """Spreads `tracks` unique tracks over `playlists` playlists.
+
+    Each playlist additionally contains the first `overlap` fraction of the
+    next playlist's tracks, so shared tracks can be measured as well.
+    Returns {playlist id: (name, [track, ...])}.
+    """
+    buckets = [[synthetic_track(index) for index in range(tracks) if index % playlists == number] for number in range(playlists)]
+    result = {}
+    for number, bucket in enumerate(buckets):
+        following = buckets[(number + 1) % playlists] if playlists > 1 else []
+        shared = following[:int(len(following) * overlap)]
+        result[f"benchplaylist{number:03d}"] = (f"Benchmark {number}", bucket + shared)
+    return result
+
+class FakeSpotify(FakeServer):
+    """Serves the client credentials token endpoint and the playlist endpoints of the Web API."""
+
+    def __init__(self, playlists, latency=0.0):
+        super().__init__(latency)
+        self.playlists = playlists
+
+    @property
+    def api_url(self):
+        return f"{self.url}/v1/"
+
+    @property
+    def auth_url(self):
+        return f"{self.url}/api/token"
+
+    def request_kind(self, path, params):
+        if path == "/api/token":
+            return "token"
+        return "playlist_items" if path.rstrip("/").endswith(("/tracks", "/items")) else "playlist"
+
+    def handle(self, method, path, params):
+        if path == "/api/token":
+            return self.json({"access_token": "benchmark", "token_type": "Bearer", "expires_in": 3600})
+
+        parts = path.strip("/").split("/")
+        if len(parts) < 3 or parts[:2] != ["v1", "playlists"] or parts[2] not in self.playlists:
+            return self.json({"error": {"status": 404, "message": "Not found"}}, 404)
+        name, tracks = self.playlists[parts[2]]
+
+        if len(parts) == 3:
+            return self.json({"id": parts[2], "name": name, "snapshot_id": f"snapshot-{len(tracks)}",
+                              "images": [], "owner": {"display_name": "benchmark"}, "tracks": {"total": len(tracks)}})
+
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", PAGE_SIZE))
+        page = tracks[offset:offset + limit]
+        following = f"{self.url}{path}?offset={offset + limit}&limit={limit}" if offset + limit < len(tracks) else None
+        return self.json({"items": [{"track": track} for track in page], "next": following, "total": len(tracks)})
+
+class FakeIndexer(FakeServer):
+    """A newznab search API that finds a release for `hit_ratio` of all queries.
+
+    Whether a query hits is derived from its checksum, so repeated runs see
+    the same hits and misses.
+    """
+
+    def __init__(self, hit_ratio=0.8, results=3, audio_format="flac", latency=0.0):
+        super().__init__(latency)
+        self.hit_ratio = hit_ratio
+        self.results = results
+        self.audio_format = audio_format
+
+    def request_kind(self, path, params):
+        return params.get("t", path)
+
+    def is_hit(self, query):
+        return zlib.crc32(query.encode()) % 1000 < self.hit_ratio * 1000
+
+    def handle(self, method, path, params):
+        query = params.get("q", "")
+        items = []
+        if params.get("t") == "search" and self.is_hit(query):
+            size = FORMAT_BYTES_PER_SECOND[self.audio_format] * TRACK_DURATION_MS // 1000
+            category = "3040" if self.audio_format == "flac" else "3010"
+            for number in range(min(self.results, int(params.get("limit") or self.results))):
+                title = escape(f"{query} (Single) {self.audio_format.upper()} {number}")
+                items.append(
+                    f"<item><title>{title}</title><pubDate>Mon, 01 Jan 2024 00:00:00 +0000</pubDate>"
+                    f'<enclosure url="{self.url}/getnzb/{zlib.crc32(query.encode())}-{number}" length="{size}" type="application/x-nzb"/>'
+                    f'<newznab:attr name="category" value="{category}"/><newznab:attr name="size" value="{size}"/></item>'
+                )
+        body = ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<rss version="2.0" xmlns:newznab="http://www.newznab.com/DTD/2010/feeds/attributes/"><channel>'
+                + "".join(items) + "</channel></rss>")
+        return 200, "application/rss+xml", body.encode()
+
+class FakeSabnzbd(FakeServer):
+    """Accepts addurl and drops a small audio file into download_dir after `download_time` seconds.
+
+    Jobs show up in the queue while they "download" and in the history once
+    the folder was written, just like SABnzbd's own API.
+    """
+
+    def __init__(self, download_dir, download_time=1.0, audio_format="flac", file_size=65536, latency=0.0):
+        super().__init__(latency)
+        self.download_dir = download_dir
+        self.download_time = download_time
+        self.audio_format = audio_format
+        self.file_size = file_size
+        self._jobs = {}
+        self._jobs_lock = threading.Lock()
+        self._history_version = 0
+
+    def request_kind(self, path, params):
+        return params.get("mode", path)
+
+    def handle(self, method, path, params):
+        mode = params.get("mode")
+        if mode == "addurl":
+            return self.json({"status": True, "nzo_ids": [self.add_job(params.get("nzbname") or params.get("name", "job"))]})
+
+        nzo_ids = set(filter(None, params.get("nzo_ids", "").split(","))) or None
+        with self._jobs_lock:
+            jobs = [dict(job) for nzo_id, job in self._jobs.items() if nzo_ids is None or nzo_id in nzo_ids]
+            version = self._history_version
+        if mode == "queue":
+            now = time.monotonic()
+            slots = [{"nzo_id": job["nzo_id"], "status": "Downloading",
+                      "percentage": str(min(99, int(100 * (now - job["added"]) / max(self.download_time, 0.001))))}
+                     for job in jobs if job["status"] != "Completed"]
+            return self.json({"queue": {"slots": slots}})
+        if mode == "history":
+            if params.get("last_history_update") == str(version):
+                return self.json({"history": {}})
+            slots = [{"nzo_id": job["nzo_id"], "status": "Completed", "storage": job["storage"]}
+                     for job in jobs if job["status"] == "Completed"]
+            return self.json({"history": {"slots": slots, "last_history_update": str(version)}})
+        return self.json({"status": False, "error": f"Unknown mode {mode}"}, 400)
+
+    def add_job(self, nzb_title):
+        with self._jobs_lock:
+            nzo_id = f"SABnzbd_nzo_{len(self._jobs):06d}"
+            self._jobs[nzo_id] = {"nzo_id": nzo_id, "status": "Downloading", "added": time.monotonic(),
+                                  "storage": os.path.join(self.download_dir, nzb_title)}
+        timer = threading.Timer(self.download_time, self.complete_job, args=(nzo_id,))
+        timer.daemon = True
+        timer.start()
+        return nzo_id
+
+    def complete_job(self, nzo_id):
+        with self._jobs_lock:
+            job = self._jobs[nzo_id]
+        os.makedirs(job["storage"], exist_ok=True)
+        with open(os.path.join(job["storage"], f"01 - track.{self.audio_format}"), "wb") as f:
+            f.write(os.urandom(self.file_size))
+        with self._jobs_lock:
+            job["status"] = "Completed"
+            self._history_version += 1
+
+FAKE_SPOTDL = """
+import os, sys, time
+args = sys.argv[1:]
+template = args[args.index("--output") + 1]
+ext = args[args.index("--format") + 1]
+for url in (arg for arg in args if arg.startswith("https://open.spotify.com/track/")):
+    time.sleep({delay})
+    track_id = url.rsplit("/", 1)[-1]
+    with open(template.replace("{{track-id}}", track_id).replace("{{output-ext}}", ext), "wb") as f:
+        f.write(os.urandom({size}))
+    print(f'Downloaded "{{track_id}}": {{url}}', flush=True)
+"""
+
+FAKE_FFMPEG = """
+import shutil, sys, time
+time.sleep({delay})
+shutil.copyfile(sys.argv[sys.argv.index("-i") + 1], sys.argv[-1])
+"""
+
+def write_fake_binaries(bin_dir, spotdl_delay=0.5, ffmpeg_delay=0.2, file_size=65536):
+    """Writes executable spotdl and ffmpeg stand-ins to bin_dir and returns their paths."""
+    os.makedirs(bin_dir, exist_ok=True)
+    paths = {}
+    for name, source in (("spotdl", FAKE_SPOTDL.format(delay=spotdl_delay, size=file_size)),
+                         ("ffmpeg", FAKE_FFMPEG.format(delay=ffmpeg_delay))):
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write(f"#!{sys.executable}\n{source.lstrip()}")
+        os.chmod(path, 0o755)
+        paths[name] = path
+    return paths
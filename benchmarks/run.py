@@ -0,0 +1,205 @@
+"""Offline end-to-end benchmark of SoundSeeker.download_each_playlist.
+
+Starts local fakes for Spotify, the indexer and SABnzbd, points SoundSeeker at
+them through the endpoint settings and reports throughput, per-stage latency
+percentiles, API calls per track and peak memory.
+
+Usage: python -m benchmarks.run --tracks 500 --playlists 5 --hit-ratio 0.8
+Tunables that are not benchmark options (PIPELINE_*, RATE_LIMIT_*, ...) are
+read from the environment as usual.
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+from sound_seeker import events, metrics, utils
+from sound_seeker.core import SoundSeeker
+from .fakes import FakeIndexer, FakeSabnzbd, FakeSpotify, synthetic_playlists, write_fake_binaries
+
+PERCENTILES = (50, 90, 99)
+
+def percentile(values, pct):
+    """Nearest-rank percentile of values, or None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))]
+
+def summarize(values):
+    summary = {"count": len(values)}
+    for pct in PERCENTILES:
+        summary[f"p{pct}"] = percentile(values, pct)
+    return summary
+
+def stage_snapshot():
+    return {dict(labels)['stage']: value for labels, value in metrics.STAGE_SECONDS.series()}
+
+def stage_latency(before, after):
+    """Percentiles per stage (pipeline stages and timed operations such as transcode) from the
+    soundseeker_stage_duration_seconds histogram, counting only what was observed between the two snapshots."""
+    latency = {}
+    for stage, (buckets, count, _, maximum) in after.items():
+        if stage in before:
+            buckets = [bucket - earlier for bucket, earlier in zip(buckets, before[stage][0])]
+            count -= before[stage][1]
+        if count:
+            latency[stage] = {"count": count}
+            for pct in PERCENTILES:
+                latency[stage][f"p{pct}"] = metrics.STAGE_SECONDS.quantile(pct / 100, buckets, count, maximum)
+    return latency
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class TrackTimer:
+    """Measures the time from TRACK_STARTED to the final event of each track."""
+
+    def __init__(self):
+        self.started = {}
+        self.durations = []
+        self.outcomes = {events.TRACK_COMPLETED: 0, events.TRACK_FAILED: 0, events.TRACK_SKIPPED: 0}
+        self.methods = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            if event.kind == events.TRACK_STARTED:
+                self.started[event.track_id] = time.monotonic()
+            elif event.kind in self.outcomes:
+                self.outcomes[event.kind] += 1
+                if event.kind == events.TRACK_COMPLETED:
+                    self.methods[event.method] = self.methods.get(event.method, 0) + 1
+                started = self.started.pop(event.track_id, None)
+                if started is not None:
+                    self.durations.append(time.monotonic() - started)
+
+def configure_environment(workdir, spotify, indexer, sabnzbd, binaries, playlist_ids):
+    paths = {key: os.path.join(workdir, name) for key, name in (
+        ("DOWNLOAD_DIR", "downloads"), ("CLEAN_DIR", "music"), ("SONG_ARCHIVE_DIR", "archive"), ("COOKIES_PATH", "config"))}
+    for path in paths.values():
+        os.makedirs(path, exist_ok=True)
+    with open(os.path.join(paths["COOKIES_PATH"], "playlists.txt"), "w") as f:
+        f.writelines(f"https://open.spotify.com/playlist/{playlist_id}\n" for playlist_id in playlist_ids)
+    open(os.path.join(paths["COOKIES_PATH"], "yt_cookies.txt"), "w").close()
+
+    os.environ.update(paths)
+    os.environ.update({
+        "SPOTIFY_PLAYLISTS_PATH": paths["COOKIES_PATH"],
+        "SPOTIFY_CLIENT_ID": "benchmark",
+        "SPOTIFY_CLIENT_SECRET": "benchmark",
+        "SPOTIFY_API_URL": spotify.api_url,
+        "SPOTIFY_AUTH_URL": spotify.auth_url,
+        "SCENENZBS_API_KEY": "benchmark",
+        "SCENENZBS_URL": f"{indexer.url}/api",
+        "EXTRA_INDEXERS": "",
+        "SABNZBD_URL": sabnzbd.url,
+        "SABNZBD_API_KEY": "benchmark",
+        "SABNZBD_CAT": "music",
+        "SPOTDL_BIN": binaries["spotdl"],
+        "FFMPEG_BIN": binaries["ffmpeg"],
+    })
+    # Production rate limits would dominate the result; set RATE_LIMIT_* explicitly to include them.
+    for upstream in ("SPOTIFY", "INDEXER", "SABNZBD"):
+        os.environ.setdefault(f"RATE_LIMIT_{upstream}", "0")
+    os.environ.setdefault("SABNZBD_POLL_INTERVAL", "0.2")
+
+def run_once(logger, fakes, unique_tracks):
+    for fake in fakes.values():
+        fake.requests.clear()
+    timer = TrackTimer()
+    seeker = SoundSeeker(logger)
+    seeker.events.subscribe(timer)
+    stages_before = stage_snapshot()
+    started = time.monotonic()
+    try:
+        seeker.download_each_playlist()
+    finally:
+        seeker.close()
+    elapsed = time.monotonic() - started
+
+    completed = timer.outcomes[events.TRACK_COMPLETED]
+    return {
+        "elapsed_seconds": elapsed,
+        "tracks_completed": completed,
+        "tracks_failed": timer.outcomes[events.TRACK_FAILED],
+        "tracks_skipped": timer.outcomes[events.TRACK_SKIPPED],
+        "completed_by_method": timer.methods,
+        "tracks_per_hour": completed / elapsed * 3600 if elapsed else None,
+        "track_latency": summarize(timer.durations),
+        "stage_latency": stage_latency(stages_before, stage_snapshot()),
+        "api_calls": {name: dict(fake.requests) for name, fake in fakes.items()},
+        "api_calls_per_track": {name: fake.total_requests / unique_tracks for name, fake in fakes.items()},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def format_seconds(value):
+    return "-" if value is None else f"{value * 1000:.0f}ms" if value < 1 else f"{value:.2f}s"
+
+def print_report(number, result):
+    print(f"\nRun {number}: {result['tracks_completed']} completed, {result['tracks_failed']} failed, "
+          f"{result['tracks_skipped']} skipped in {result['elapsed_seconds']:.1f}s "
+          f"({', '.join(f'{method}: {count}' for method, count in sorted(result['completed_by_method'].items())) or 'nothing new'})")
+    if result['tracks_per_hour'] is not None:
+        print(f"  {'Throughput:':<24} {result['tracks_per_hour']:.0f} tracks/hour")
+    rows = [("track", result['track_latency'])] + list(result['stage_latency'].items())
+    for name, summary in rows:
+        if summary["count"]:
+            print(f"  {name + ' latency:':<24} " + "  ".join(f"p{pct} {format_seconds(summary[f'p{pct}'])}" for pct in PERCENTILES)
+                  + f"  (n={summary['count']})")
+    for name, calls in result['api_calls_per_track'].items():
+        print(f"  {name + ' calls:':<24} {calls:.2f} per track  {result['api_calls'][name]}")
+    print(f"  {'Peak RSS:':<24} {result['peak_rss_mb']:.1f} MB")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=200, help="unique tracks over all playlists")
+    parser.add_argument("--playlists", type=int, default=4)
+    parser.add_argument("--overlap", type=float, default=0.1, help="fraction of each playlist shared with the next one")
+    parser.add_argument("--hit-ratio", type=float, default=0.8, help="fraction of searches the indexer finds a release for")
+    parser.add_argument("--format", choices=("flac", "mp3"), default="flac", help="audio format of the fake releases")
+    parser.add_argument("--download-time", type=float, default=1.0, help="seconds a fake SABnzbd job takes")
+    parser.add_argument("--spotify-latency", type=float, default=0.02)
+    parser.add_argument("--indexer-latency", type=float, default=0.1)
+    parser.add_argument("--sabnzbd-latency", type=float, default=0.01)
+    parser.add_argument("--spotdl-time", type=float, default=0.5, help="seconds the fake spotdl spends per track")
+    parser.add_argument("--ffmpeg-time", type=float, default=0.2, help="seconds the fake ffmpeg spends per file")
+    parser.add_argument("--runs", type=int, default=1, help="runs against the same library; later runs measure incremental syncs")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show SoundSeeker's log output")
+    args = parser.parse_args(argv)
+
+    logger = utils.setup_logger(level=logging.INFO if args.verbose else logging.WARNING)
+    playlists = synthetic_playlists(args.tracks, args.playlists, args.overlap)
+    with tempfile.TemporaryDirectory(prefix="soundseeker-bench-") as workdir:
+        download_dir = os.path.join(workdir, "downloads")
+        fakes = {
+            "spotify": FakeSpotify(playlists, latency=args.spotify_latency).start(),
+            "indexer": FakeIndexer(args.hit_ratio, audio_format=args.format, latency=args.indexer_latency).start(),
+            "sabnzbd": FakeSabnzbd(download_dir, args.download_time, audio_format=args.format, latency=args.sabnzbd_latency).start(),
+        }
+        binaries = write_fake_binaries(os.path.join(workdir, "bin"), spotdl_delay=args.spotdl_time, ffmpeg_delay=args.ffmpeg_time)
+        configure_environment(workdir, fakes["spotify"], fakes["indexer"], fakes["sabnzbd"], binaries, list(playlists))
+        try:
+            results = [run_once(logger, fakes, args.tracks) for _ in range(args.runs)]
+        finally:
+            for fake in fakes.values():
+                fake.stop()
+
+    if args.json:
+        print(json.dumps({"options": vars(args), "runs": results}, indent=2))
+    else:
+        print(f"{args.tracks} tracks in {args.playlists} playlists, {args.hit_ratio:.0%} indexer hits, "
+              f"{args.download_time}s per SABnzbd job")
+        for number, result in enumerate(results, start=1):
+            print_report(number, result)
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,27 @@
+import argparse
 import logging
 from sound_seeker.core import SoundSeeker
+from sound_seeker import metrics
 from sound_seeker.utils import setup_logger
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Downloads your Spotify playlists into the music library.")
+    parser.add_argument("--remove-empty-folders", action="store_true",
+                        help="after the run, sweep the whole library for empty folders (limited by FOLDER_CLEANUP_RATE)")
+    args = parser.parse_args()
+
     logger = setup_logger(level=logging.INFO)
+    downloader = None
     try:
         downloader = SoundSeeker(logger=logger)
-        downloader.remove_empty_folders()
         downloader.download_each_playlist()
         logger.info("SoundSeeker successfully completed all tasks.")
     except Exception as e:
-        logger.critical(f"Critical error in SoundSeeker: {e}")
\ No newline at end of file
+        logger.critical(f"Critical error in SoundSeeker: {e}")
+    finally:
+        if downloader:
+            downloader.close()
+            if args.remove_empty_folders:
+                downloader.remove_empty_folders()
+            for line in metrics.summary_lines():
+                logger.info(line)
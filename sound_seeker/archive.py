@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import threading
+import time
+from . import metrics
+
+class SongArchive:
+    """Archive of downloaded tracks stored in SQLite (WAL mode).
+
+    Membership checks are answered from an in-memory set of track ids that is
+    loaded once; listing, tail queries and lookups go to the indexed table.
+    An existing songarchive.log is imported on first use.
+    """
+
+    def __init__(self, db_path, logger, legacy_log_path=None):
+        self.db_path = db_path
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._ids = None
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tracks ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, track_id TEXT UNIQUE NOT NULL, "
+            "path TEXT, ext TEXT, source TEXT, size INTEGER, added_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+        if legacy_log_path:
+            self._import_legacy_log(legacy_log_path)
+
+    @classmethod
+    def from_env(cls, env, logger):
+        return cls(os.path.join(env["SONG_ARCHIVE_DIR"], "songarchive.db"), logger,
+                   legacy_log_path=os.path.join(env["SONG_ARCHIVE_DIR"], "songarchive.log"))
+
+    def _get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _import_legacy_log(self, log_path):
+        if not os.path.exists(log_path) or self._get_meta("legacy_log_imported"):
+            return
+        try:
+            with open(log_path, "r") as f:
+                track_ids = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+            now = time.time()
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO tracks (track_id, source, added_at) VALUES (?, 'legacy', ?)",
+                    ((track_id, now) for track_id in track_ids)
+                )
+                self._set_meta("legacy_log_imported", now)
+                self._conn.commit()
+            self.logger.info(f"Imported {len(track_ids)} tracks from {log_path} into the song archive.")
+        except Exception as e:
+            self.logger.error(f"Error importing song archive log: {e}")
+
+    def _load_ids(self):
+        if self._ids is None:
+            with self._lock:
+                if self._ids is None:
+                    self._ids = {row["track_id"] for row in self._conn.execute("SELECT track_id FROM tracks")}
+        return self._ids
+
+    def __contains__(self, track_id):
+        return track_id in self._load_ids()
+
+    def __len__(self):
+        return self.count()
+
+    def add(self, track_id, path=None, ext=None, source=None, size=None):
+        try:
+            with self._lock, metrics.STAGE_SECONDS.time(stage="archive_write"):
+                self._conn.execute(
+                    "INSERT INTO tracks (track_id, path, ext, source, size, added_at) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(track_id) DO UPDATE SET path = excluded.path, ext = excluded.ext, "
+                    "source = excluded.source, size = excluded.size",
+                    (track_id, path, ext, source, size, time.time())
+                )
+                self._conn.commit()
+                if self._ids is not None:
+                    self._ids.add(track_id)
+            self.logger.info(f"Added '{track_id}' to song archive.")
+        except sqlite3.Error as e:
+            self.logger.error(f"Error saving to song archive: {e}")
+
+    def get(self, track_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM tracks WHERE track_id = ?", (track_id,)).fetchone()
+        return dict(row) if row else None
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    def list(self, offset=0, limit=100):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM tracks ORDER BY seq LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def recent(self, limit=5):
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM tracks ORDER BY seq DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def compact(self, min_interval=0):
+        """Checkpoints the WAL and vacuums the database, at most once per min_interval seconds."""
+        try:
+            with self._lock:
+                last = float(self._get_meta("last_compaction") or 0)
+                if time.time() - last < min_interval:
+                    return False
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                self._conn.execute("VACUUM")
+                self._set_meta("last_compaction", time.time())
+                self._conn.commit()
+            self.logger.info("Song archive compacted.")
+            return True
+        except sqlite3.Error as e:
+            self.logger.error(f"Error compacting song archive: {e}")
+            return False
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
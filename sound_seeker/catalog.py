@@ -0,0 +1,217 @@
+import json
+import os
+import threading
+import time
+
+PLAYLIST_URL_PREFIX = "https://open.spotify.com/"
+# Playlists whose lookup failed are retried after this many seconds instead of on every request.
+FAILED_RETRY_INTERVAL = 300
+
+def playlist_id_from_url(url):
+    return url.split('/')[-1].split('?')[0]
+
+class PlaylistCatalog:
+    """The playlists in playlists.txt with their Spotify details, served stale-while-revalidate.
+
+    list() answers from memory right away and hands playlists without details
+    or with details older than `ttl` seconds to a background worker, which
+    fetches them through the MetadataService, persists the catalogue and calls
+    on_change(playlists). add() appends one line to playlists.txt and remove()
+    rewrites the file locally; neither waits for Spotify. Edits made to
+    playlists.txt by hand are picked up through its mtime.
+    """
+
+    def __init__(self, playlists_path, state_path, metadata, logger, ttl=3600, on_change=None):
+        self.playlists_path = playlists_path
+        self.state_path = state_path
+        self.metadata = metadata
+        self.logger = logger
+        self.ttl = ttl
+        self.on_change = on_change
+        self._urls = []
+        self._file_mtime = None
+        self._entries = self._load_state()
+        self._pending = set()
+        self._lock = threading.RLock()
+        self._wake = threading.Condition(self._lock)
+        self._closed = False
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, env, metadata, logger, on_change=None):
+        return cls(os.path.join(env["SPOTIFY_PLAYLISTS_PATH"], 'playlists.txt'),
+                   os.path.join(env["SONG_ARCHIVE_DIR"], "playlist_catalog.json"), metadata, logger,
+                   ttl=env['PLAYLIST_CATALOG_TTL'], on_change=on_change)
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("playlists", {})
+        except Exception as e:
+            self.logger.error(f"Error loading playlist catalogue, rebuilding it: {e}")
+            return {}
+
+    def _save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with self._lock:
+            state = {"playlists": dict(self._entries)}
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+        except Exception as e:
+            self.logger.error(f"Error saving playlist catalogue: {e}")
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.playlists_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._file_mtime:
+            return
+        urls = []
+        if mtime is not None:
+            with open(self.playlists_path, "r") as f:
+                urls = [line.strip() for line in f if line.strip().startswith(PLAYLIST_URL_PREFIX)]
+        self._urls = list(dict.fromkeys(urls))
+        self._file_mtime = mtime
+
+    def _remember_mtime(self):
+        try:
+            self._file_mtime = os.stat(self.playlists_path).st_mtime_ns
+        except FileNotFoundError:
+            self._file_mtime = None
+
+    def _describe(self, url):
+        playlist_id = playlist_id_from_url(url)
+        info = self._entries.get(playlist_id, {}).get("info")
+        if info:
+            return dict(info, url=url)
+        return {'id': playlist_id, 'name': f"Playlist {playlist_id}", 'tracks_total': 0, 'image': '', 'owner': '', 'url': url}
+
+    def _is_stale(self, playlist_id, now):
+        entry = self._entries.get(playlist_id)
+        if not entry:
+            return True
+        max_age = self.ttl if entry.get("info") else min(self.ttl, FAILED_RETRY_INTERVAL)
+        return now - entry.get("checked_at", 0) >= max_age
+
+    def list(self):
+        """Returns all playlists with their last known details and refreshes stale ones in the background."""
+        with self._lock:
+            self._reload_if_changed()
+            now = time.time()
+            playlists = [self._describe(url) for url in self._urls]
+            stale = [playlist['id'] for playlist in playlists if self._is_stale(playlist['id'], now)]
+            if stale:
+                self._schedule(stale)
+        return playlists
+
+    def urls(self):
+        with self._lock:
+            self._reload_if_changed()
+            return list(self._urls)
+
+    def add(self, url):
+        """Appends a playlist to playlists.txt. Returns False if it is already listed."""
+        with self._lock:
+            self._reload_if_changed()
+            if url in self._urls:
+                return False
+            with open(self.playlists_path, "a+") as f:
+                if f.tell() > 0:
+                    f.seek(f.tell() - 1)
+                    if f.read(1) != "\n":
+                        f.write("\n")
+                f.write(f"{url}\n")
+            self._remember_mtime()
+            self._urls.append(url)
+            self._schedule([playlist_id_from_url(url)])
+        self._notify()
+        return True
+
+    def remove(self, url):
+        """Removes a playlist from playlists.txt. Returns False if it is not listed."""
+        with self._lock:
+            self._reload_if_changed()
+            if url not in self._urls:
+                return False
+            with open(self.playlists_path, "r") as f:
+                lines = [line for line in f if line.strip() != url]
+            tmp_path = f"{self.playlists_path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.writelines(lines)
+            os.replace(tmp_path, self.playlists_path)
+            self._remember_mtime()
+            self._urls.remove(url)
+            playlist_id = playlist_id_from_url(url)
+            if not any(playlist_id_from_url(other) == playlist_id for other in self._urls):
+                self._entries.pop(playlist_id, None)
+                self._pending.discard(playlist_id)
+        self._notify()
+        return True
+
+    def _schedule(self, playlist_ids):
+        with self._lock:
+            self._pending.update(playlist_ids)
+            if self._thread is None:
+                self._closed = False
+                self._thread = threading.Thread(target=self._run, name="playlist-catalogue", daemon=True)
+                self._thread.start()
+            self._wake.notify_all()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._closed:
+                    self._wake.wait()
+                if self._closed:
+                    return
+                batch, self._pending = list(self._pending), set()
+            try:
+                self.refresh(batch)
+            except Exception as e:
+                self.logger.error(f"Error refreshing playlist details: {e}")
+                self._mark_checked(batch)
+
+    def _mark_checked(self, playlist_ids):
+        """Keeps a failed refresh from being retried on every list() until the entries are stale again."""
+        now = time.time()
+        with self._lock:
+            for playlist_id in playlist_ids:
+                self._entries.setdefault(playlist_id, {})["checked_at"] = now
+
+    def refresh(self, playlist_ids):
+        """Fetches fresh details for the given playlists and notifies on_change if anything changed."""
+        infos = self.metadata.get_playlists(playlist_ids, refresh=True)
+        now = time.time()
+        changed = False
+        with self._lock:
+            for playlist_id in playlist_ids:
+                entry = self._entries.setdefault(playlist_id, {})
+                entry["checked_at"] = now
+                info = infos.get(playlist_id)
+                if info and info != entry.get("info"):
+                    entry["info"] = info
+                    changed = True
+        self._save_state()
+        if changed:
+            self._notify()
+
+    def _notify(self):
+        if not self.on_change:
+            return
+        try:
+            self.on_change(self.list())
+        except Exception as e:
+            self.logger.error(f"Error publishing playlist changes: {e}")
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wake.notify_all()
+            thread, self._thread = self._thread, None
+        if thread:
+            thread.join(timeout=5)
@@ -0,0 +1,174 @@
+import threading
+import requests
+import spotipy
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+from spotipy.cache_handler import MemoryCacheHandler
+from spotipy.oauth2 import SpotifyClientCredentials
+from .control import current_scope
+from .ratelimit import TokenBucket, RetryBudget, parse_retry_after, backoff_delay, sleep
+from . import metrics
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+def request_not_sent(error):
+    """Returns True if the connection failed before the request reached the server."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, ConnectTimeoutError)
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default timeout, the upstream's rate limit and retries.
+
+    Requests on HTTP 429/5xx and connection errors are retried up to `retries`
+    times with jittered exponential backoff, as long as the retry budget
+    allows it. A Retry-After header pauses every request to the upstream; a
+    Retry-After longer than max_retry_after is returned to the caller.
+    Adapters for requests that are not idempotent (idempotent=False, e.g.
+    SABnzbd's addurl) only retry when the request never reached the server:
+    failed connections and HTTP 429.
+    Requests, retries, throttling and errors are counted in metrics.HTTP_STATS.
+    Waits end with InterruptedError when the calling thread's CancelScope
+    (see control.current_scope) is cancelled, so stop and skip are not held
+    up by a backoff.
+    """
+
+    def __init__(self, *args, upstream="http", timeout=None, limiter=None, budget=None, retries=3, backoff_factor=0.5,
+                 max_retry_after=120, idempotent=True, **kwargs):
+        self.upstream = upstream
+        self.idempotent = idempotent
+        self.timeout = timeout
+        self.limiter = limiter or TokenBucket(0)
+        self.budget = budget or RetryBudget()
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_retry_after = max_retry_after
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        scope = current_scope()
+        attempt = 0
+        while True:
+            waited = self.limiter.acquire(scope)
+            if waited:
+                self._count("throttled")
+                self._count("throttle_seconds", waited)
+            self._count("requests")
+            self.budget.deposit()
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not (self.idempotent or request_not_sent(e)) or not self._may_retry(attempt):
+                    self._count("errors")
+                    raise
+                sleep(backoff_delay(attempt, self.backoff_factor), scope)
+                attempt += 1
+                continue
+
+            if response.status_code not in RETRY_STATUSES or (not self.idempotent and response.status_code != 429):
+                if response.status_code >= 400:
+                    self._count("errors")
+                return response
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if response.status_code == 429:
+                self._count("rate_limited")
+            if (retry_after is not None and retry_after > self.max_retry_after) or not self._may_retry(attempt):
+                self._count("errors")
+                return response
+            response.close()
+            if retry_after is not None:
+                self.limiter.backoff(retry_after)
+            else:
+                sleep(backoff_delay(attempt, self.backoff_factor), scope)
+            attempt += 1
+
+    def _may_retry(self, attempt):
+        if attempt >= self.retries:
+            return False
+        if not self.budget.withdraw():
+            self._count("retries_denied")
+            return False
+        self._count("retries")
+        return True
+
+    def _count(self, field, value=1):
+        metrics.HTTP_STATS[field].inc(value, upstream=self.upstream)
+
+class ClientRegistry:
+    """Owns the shared Spotify client and the pooled requests.Sessions.
+
+    There is one session per upstream, or per upstream and name where one
+    upstream stands for several services (each indexer), each with its own
+    rate limit and retry budget. Sessions for non-idempotent requests
+    (idempotent=False) share them but retry less. Limits outlive close(), so a
+    new run does not start with a fresh burst.
+    """
+
+    def __init__(self, env, logger):
+        self.env = env
+        self.logger = logger
+        self._sessions = {}
+        self._limiters = {}
+        self._budgets = {}
+        self._spotify = None
+        self._lock = threading.Lock()
+
+    def session(self, upstream, name=None, idempotent=True):
+        key = (upstream, name)
+        with self._lock:
+            if (key, idempotent) not in self._sessions:
+                self._sessions[(key, idempotent)] = self._build_session(upstream, key, idempotent)
+            return self._sessions[(key, idempotent)]
+
+    def _build_session(self, upstream, key, idempotent):
+        if key not in self._limiters:
+            self._limiters[key] = TokenBucket(self.env[f'RATE_LIMIT_{upstream.upper()}'])
+            self._budgets[key] = RetryBudget(ratio=self.env['HTTP_RETRY_BUDGET'])
+        adapter = PooledHTTPAdapter(
+            upstream=upstream,
+            pool_connections=self.env['HTTP_POOL_SIZE'],
+            pool_maxsize=self.env['HTTP_POOL_SIZE'],
+            timeout=self.env['HTTP_TIMEOUT'],
+            limiter=self._limiters[key],
+            budget=self._budgets[key],
+            retries=self.env['HTTP_RETRIES'],
+            backoff_factor=self.env['HTTP_BACKOFF_FACTOR'],
+            max_retry_after=self.env['HTTP_MAX_RETRY_AFTER'],
+            idempotent=idempotent,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @property
+    def spotify(self):
+        if self._spotify is None:
+            session = self.session("spotify")
+            with self._lock:
+                if self._spotify is None:
+                    auth_manager = SpotifyClientCredentials(
+                        client_id=self.env['SPOTIFY_CLIENT_ID'],
+                        client_secret=self.env['SPOTIFY_CLIENT_SECRET'],
+                        requests_session=session,
+                        cache_handler=MemoryCacheHandler(),
+                    )
+                    auth_manager.OAUTH_TOKEN_URL = self.env['SPOTIFY_AUTH_URL']
+                    spotify = spotipy.Spotify(
+                        auth_manager=auth_manager,
+                        requests_session=session,
+                        requests_timeout=self.env['HTTP_TIMEOUT'],
+                    )
+                    spotify.prefix = self.env['SPOTIFY_API_URL'].rstrip("/") + "/"
+                    self._spotify = spotify
+        return self._spotify
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+            self._spotify = None
@@ -0,0 +1,154 @@
+import threading
+from contextlib import contextmanager
+
+class CancelScope:
+    """Cancellation token for a track or a whole run.
+
+    Blocking code registers callbacks (e.g. process.terminate or event.set)
+    that run as soon as the scope is cancelled, so no wait has to poll.
+    """
+
+    def __init__(self, label, skippable=True):
+        self.label = label
+        self.skippable = skippable
+        self.cancelled_event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.cancelled_event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled_event.is_set():
+                return
+            self.cancelled_event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if not self.cancelled_event.is_set():
+                self._callbacks.append(callback)
+                return callback
+        callback()
+        return callback
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def sleep(self, seconds):
+        """Sleeps for up to seconds. Returns True if the scope was cancelled."""
+        return self.cancelled_event.wait(seconds)
+
+    @contextmanager
+    def attach_process(self, process):
+        """Terminates the child process if the scope is cancelled while it runs."""
+        callback = self.on_cancel(process.terminate)
+        try:
+            yield process
+        finally:
+            self.remove_callback(callback)
+
+_local = threading.local()
+
+def current_scope():
+    """Returns the CancelScope the calling thread works for, or None."""
+    return getattr(_local, "scope", None)
+
+@contextmanager
+def bind_scope(scope):
+    """Makes scope the calling thread's current scope, e.g. in work handed to a thread pool."""
+    previous = current_scope()
+    _local.scope = scope
+    try:
+        yield scope
+    finally:
+        _local.scope = previous
+
+class RunControl:
+    """Pause, stop and skip handling for a download run.
+
+    stop() cancels the run scope and every active scope, skip() cancels the
+    most recently started skippable scope (or the next track if none is
+    active), and
+    pause() makes wait_if_paused() block on a condition until resume() or stop().
+    Create a new RunControl for every run.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._paused = False
+        self._skip_pending = False
+        self._active = []
+        self.run_scope = CancelScope("run")
+
+    @property
+    def stopped(self):
+        return self.run_scope.cancelled
+
+    @property
+    def paused(self):
+        return self._paused and not self.stopped
+
+    def stop(self):
+        with self._cond:
+            self._paused = False
+            scopes = list(self._active)
+            self._cond.notify_all()
+        self.run_scope.cancel()
+        for scope in scopes:
+            scope.cancel()
+
+    def pause(self):
+        with self._cond:
+            self._paused = True
+
+    def resume(self):
+        with self._cond:
+            self._paused = False
+            self._cond.notify_all()
+
+    def skip(self):
+        with self._cond:
+            scope = next((scope for scope in reversed(self._active) if scope.skippable), None)
+            if scope is None:
+                self._skip_pending = True
+        if scope:
+            scope.cancel()
+
+    def consume_skip(self):
+        with self._cond:
+            skip, self._skip_pending = self._skip_pending, False
+            return skip
+
+    def wait_if_paused(self):
+        """Blocks while the run is paused. Returns True if it had to wait."""
+        with self._cond:
+            if not self._paused or self.stopped:
+                return False
+            while self._paused and not self.stopped:
+                self._cond.wait()
+            return True
+
+    @contextmanager
+    def track(self, label, skippable=True):
+        """Registers a scope for work on one track. Scopes covering several tracks pass skippable=False, so only stop() cancels them."""
+        scope = CancelScope(label, skippable)
+        with self._cond:
+            self._active.append(scope)
+        if self.stopped:
+            scope.cancel()
+        try:
+            with bind_scope(scope):
+                yield scope
+        finally:
+            with self._cond:
+                self._active.remove(scope)
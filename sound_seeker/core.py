@@ -1,149 +1,595 @@
 import os
 from dotenv import load_dotenv
-import time
+import threading
+import shutil
+import tempfile
 from . import utils, services, file_handler
+from .pipeline import TrackPipeline
+from .clients import ClientRegistry
+from .sabnzbd import SabnzbdTracker
+from .search_cache import SearchCache
+from .indexers import IndexerSearch, rank_candidates
+from .playlist_state import PlaylistStateStore, diff_tracks
+from .archive import SongArchive
+from .journal import RunJournal
+from . import journal
+from .m3u import M3UManager
+from .library import LibraryIndex
+from .transcoder import Transcoder
+from .control import RunControl
+from . import events, metrics, tracing
+from .events import EventBus
 
 class SoundSeeker:
-    def __init__(self, logger):
+    def __init__(self, logger, clients=None, control=None, event_bus=None):
         load_dotenv()
         self.logger = logger
         self.env = utils.get_cached_env(self.logger)
-        self.song_archive_path = os.path.join(self.env["SONG_ARCHIVE_DIR"], "songarchive.log")
-        self.song_archive = utils.load_song_archive(self.song_archive_path, self.logger)
-        self.stop_event = None
-        self.pause_event = None
-        self.skip_event = None
-        
-    def check_events(self):
-        if self.stop_event and self.stop_event.is_set():
+        self._owns_clients = clients is None
+        self.clients = clients or ClientRegistry(self.env, self.logger)
+        self.song_archive = SongArchive.from_env(self.env, self.logger)
+        self.journal = RunJournal.from_env(self.env, self.logger)
+        self.control = control or RunControl()
+        self.events = event_bus or EventBus(self.logger)
+        self.events.subscribe(metrics.record_event)
+        self.pipeline = TrackPipeline.from_env(self.env, self.logger)
+        self._archive_lock = threading.Lock()
+        self._spotdl_queue = []
+        self._memberships = {}
+        self._spotdl_lock = threading.Lock()
+        self.sabnzbd = SabnzbdTracker(self.clients.session("sabnzbd"), self.env['SABNZBD_URL'], self.env['SABNZBD_API_KEY'], self.logger,
+                                      poll_interval=self.env['SABNZBD_POLL_INTERVAL'])
+        self.search_cache = SearchCache(os.path.join(self.env["SONG_ARCHIVE_DIR"], "searchcache.db"), self.logger,
+                                        positive_ttl=self.env['SEARCH_CACHE_TTL'],
+                                        negative_ttl=self.env['SEARCH_CACHE_NEGATIVE_TTL'],
+                                        max_entries=self.env['SEARCH_CACHE_MAX_ENTRIES'])
+        self.indexers = IndexerSearch.from_env(self.env, self.clients, self.logger)
+        self.library = LibraryIndex(self.env['CLEAN_DIR'], os.path.join(self.env["SONG_ARCHIVE_DIR"], "library_index.json"), self.logger,
+                                    full_scan_interval=self.env['LIBRARY_FULL_SCAN_INTERVAL'])
+        self.tracer = tracing.from_env(self.env, self.logger)
+        self.transcoder = Transcoder.from_env(self.env, self.logger, tracer=self.tracer)
+        self.m3u = M3UManager(self.env['CLEAN_DIR'], self.logger, flush_every=self.env['M3U_FLUSH_EVERY'])
+        self.library_folders = file_handler.LibraryFolders(self.env['CLEAN_DIR'], self.logger)
+        self.playlist_state = PlaylistStateStore(os.path.join(self.env["SONG_ARCHIVE_DIR"], "playlist_state"), self.logger)
+
+    def check_events(self, cancel_scope=None):
+        """Returns True if the run was stopped, "skip" if the track was skipped and False otherwise.
+
+        While the run is paused this blocks on the run control until it is resumed or stopped.
+        """
+        if self.control.stopped:
             self.logger.info("Stop event detected. Terminating download.")
             return True
 
-        if self.pause_event and self.pause_event.is_set():
+        if self.control.paused:
             self.logger.info("Pause-Event detected. Waiting for resume...")
-            while self.pause_event.is_set() and not (self.stop_event and self.stop_event.is_set()):
-                if self.skip_event and self.skip_event.is_set():
-                    self.logger.info("Skip event detected during pause. Will skip after resume.")
-                time.sleep(0.5)
-                
-            if self.stop_event and self.stop_event.is_set():
+            self.control.wait_if_paused()
+            if self.control.stopped:
                 return True
-                
             self.logger.info("Resuming download after pause.")
-            
-        if self.skip_event and self.skip_event.is_set():
+
+        if (cancel_scope and cancel_scope.cancelled) or self.control.consume_skip():
             self.logger.info("Skip event detected. Moving to next track.")
-            self.skip_event.clear()
             return "skip"
-            
+
         return False
 
-    def download_tracks(self, playlist_tracks, playlist_name):
-        total = len(playlist_tracks)
-        for step, item in enumerate(playlist_tracks, start=1):
-            # Only for debugging purposes, uncomment to limit steps
-            # if step >= 5:
-            #     break
-            
-            check_result = self.check_events()
-            if check_result is True: 
-                return
-            elif check_result == "skip":
-                continue
-        
-            if not item or not item.get('track'):
-                self.logger.warning(f"Skipping invalid track item in {playlist_name} at step {step}.")
-                continue
+    def download_tracks(self, queue):
+        """Processes a work queue built by build_work_queue, each unique track once."""
+        total = len(queue)
+        jobs = [(step, entry['item'], total, entry['playlists'][0]) for step, entry in enumerate(queue, start=1)]
+        self.pipeline.run(jobs, self.process_track)
+        if not self.stop_requested():
+            self.flush_spotdl_queue()
 
-            track = item['track']
-            track_id = track['id']
-            artist_search_str = ' '.join(artist['name'] for artist in track['artists'])
-            artist_file_str = ', '.join(artist['name'] for artist in track['artists'])
-            title_str = track['name']
+    def playlists_of(self, track_id, playlist_name):
+        """Returns every playlist of the current run that contains the track."""
+        return self._memberships.get(track_id) or [playlist_name]
+
+    def process_track(self, step, item, total, playlist_name):
+        """Handles a single playlist entry. Returns True if the run should stop."""
+        # Only for debugging purposes, uncomment to limit steps
+        # if step >= 5:
+        #     return True
+
+        check_result = self.check_events()
+        if check_result is True:
+            return True
+        elif check_result == "skip":
+            self.events.publish(events.TRACK_SKIPPED, playlist=playlist_name)
+            return False
+
+        if not item or not item.get('track'):
+            self.logger.warning(f"Skipping invalid track item in {playlist_name} at step {step}.")
+            self.events.publish(events.TRACK_SKIPPED, playlist=playlist_name, message="Invalid track item")
+            return False
 
-            self.logger.info(f"Processing {step}/{total}: {artist_file_str} - {title_str}")
+        track = item['track']
+        track_id = track['id']
+        artist_search_str = ' '.join(artist['name'] for artist in track['artists'])
+        artist_file_str = ', '.join(artist['name'] for artist in track['artists'])
+        title_str = track['name']
 
-            if track_id in self.song_archive:
-                self.logger.info(f"Track already in archive. Adding to playlist {playlist_name} and skipping download...")
-                if file_handler.check_if_song_exists(artist_file_str, title_str, self.env['CLEAN_DIR'], self.logger, ext="ogg"):
-                    file_handler.create_and_add_to_m3u(playlist_name, artist_file_str, title_str, self.env['CLEAN_DIR'], self.logger, ext="ogg")
-                elif file_handler.check_if_song_exists(artist_file_str, title_str, self.env['CLEAN_DIR'], self.logger, ext="mp3"):
-                    file_handler.create_and_add_to_m3u(playlist_name, artist_file_str, title_str, self.env['CLEAN_DIR'], self.logger, ext="mp3")
+        self.logger.info(f"Processing {step}/{total}: {artist_file_str} - {title_str}")
+        self.events.publish(events.TRACK_STARTED, track_id, f"{artist_file_str} - {title_str}", playlist=playlist_name)
+
+        with self.control.track(f"{artist_file_str} - {title_str}") as scope, \
+                self.tracer.span("track", track_id=track_id, track=f"{artist_file_str} - {title_str}", playlist=playlist_name):
+            return self.process_track_in_scope(track_id, artist_search_str, artist_file_str, title_str, playlist_name, scope,
+                                               duration_ms=track.get('duration_ms'))
+
+    def process_track_in_scope(self, track_id, artist_search_str, artist_file_str, title_str, playlist_name, scope, duration_ms=None):
+        label = f"{artist_file_str} - {title_str}"
+        if track_id in self.song_archive:
+            playlist_names = self.playlists_of(track_id, playlist_name)
+            self.logger.info(f"Track already in archive. Adding to playlist {', '.join(playlist_names)} and skipping download...")
+            with self.tracer.span("archive", source="archive") as span, self.pipeline.stage("archive"):
+                ext = self.library.find(artist_file_str, title_str)
+                span.set(ext=ext, playlists=len(playlist_names))
+                if ext:
+                    self.add_to_m3u(playlist_names, artist_file_str, title_str, ext=ext)
+                    self.events.publish(events.TRACK_COMPLETED, track_id, label, playlist=playlist_name, method="archive")
                 else:
-                    self.logger.warning(f"Archived song '{artist_file_str} - {title_str}' not found on disk. Re-downloading might be necessary.")
-                continue
+                    self.logger.warning(f"Archived song '{label}' not found on disk. Re-downloading might be necessary.")
+                    self.events.publish(events.TRACK_FAILED, track_id, label, playlist=playlist_name, method="archive",
+                                        message="Archived file not found on disk")
+            return False
 
-            if self.try_usenet_download(artist_search_str, artist_file_str, title_str, track_id, playlist_name):
-                continue
+        usenet_result = self.try_usenet_download(artist_search_str, artist_file_str, title_str, track_id, playlist_name, scope,
+                                                 duration_ms=duration_ms)
+        if usenet_result is None:
+            if not self.stop_requested():
+                self.events.publish(events.TRACK_SKIPPED, track_id, label, playlist=playlist_name)
+            return self.stop_requested()
+        if usenet_result:
+            return False
 
-            self.logger.warning(f"No NZB found for '{artist_file_str} - {title_str}', trying SpotDL...")
-            self.try_spotdl_download(track_id, artist_file_str, title_str, playlist_name)
+        self.logger.warning(f"No NZB found for '{artist_file_str} - {title_str}', trying SpotDL...")
+        self.try_spotdl_download(track_id, artist_file_str, title_str, playlist_name, scope)
+        return self.stop_requested()
 
-    def try_usenet_download(self, artist_search_str, artist_file_str, title_str, track_id, playlist_name):
-        if self.check_events():
-            return
+    def stop_requested(self):
+        return self.control.stopped
+
+    def record_download(self, track_id, playlist_name, artist_file_str, title_str, ext, source):
+        track_path = os.path.join(artist_file_str, title_str, f"{artist_file_str} - {title_str}.{ext}")
+        try:
+            size = os.path.getsize(os.path.join(self.env['CLEAN_DIR'], track_path))
+        except OSError:
+            size = None
+        with self.tracer.span("archive", source=source, ext=ext, bytes=size), self._archive_lock:
+            self.song_archive.add(track_id, path=track_path, ext=ext, source=source, size=size)
+            self.add_to_m3u(self.playlists_of(track_id, playlist_name), artist_file_str, title_str, ext=ext)
+        self.journal.remove(track_id)
+        self.events.publish(events.TRACK_COMPLETED, track_id, f"{artist_file_str} - {title_str}", playlist=playlist_name, method=source)
+
+    def add_to_m3u(self, playlist_names, artist_file_str, title_str, ext):
+        for playlist_name in playlist_names:
+            self.m3u.add(playlist_name, artist_file_str, title_str, ext=ext)
+
+    def try_usenet_download(self, artist_search_str, artist_file_str, title_str, track_id, playlist_name, scope=None, duration_ms=None):
+        """Returns True on success, False if Usenet had no usable result and None if the track was stopped or skipped.
+
+        Releases are tried best first, as ranked by indexers.rank_candidates.
+        """
+        if self.check_events(scope):
+            return None
+        resumed = self.resume_usenet_download(track_id, artist_file_str, title_str, playlist_name, scope)
+        if resumed is not False:
+            return resumed
         query = f"{artist_search_str} {title_str}"
-        data = services.get_music_by_search(query, self.env['SCENENZBS_API_KEY'], self.logger)
-        if not data or data.get("rss", {}).get("channel", {}).get("newznab:response", {}).get("@total") == "0":
+        with self.tracer.span("search", query=query) as span, self.pipeline.stage("search"):
+            candidates = self.search_usenet(query)
+            span.set(candidates=len(candidates or []))
+        if not candidates:
+            return False
+
+        candidates = rank_candidates(candidates, artist_file_str, title_str, duration_ms=duration_ms,
+                                     min_similarity=self.env['INDEXER_MIN_SIMILARITY'])
+        if not candidates:
+            self.logger.info(f"No NZB matching '{artist_file_str} - {title_str}' closely enough.")
             return False
 
-        items = data['rss']['channel'].get('item', [])
-        items = [items] if isinstance(items, dict) else items
-
-        for item in items:
-            nzb_url = item.get('enclosure', {}).get('@url')
-            nzb_title = f"{artist_file_str} - {title_str}"
-            if nzb_url:
-                self.logger.info(f"NZB found: {nzb_title}")
-                services.send_to_sabnzbd(nzb_url, nzb_title, self.env['SABNZBD_URL'], self.env['SABNZBD_API_KEY'], self.env['SABNZBD_CAT'], self.logger)
-                
-                ext = file_handler.wait_for_download_folder(nzb_title, self.env['DOWNLOAD_DIR'], self.logger)
+        nzb_title = f"{artist_file_str} - {title_str}"
+        for candidate in candidates:
+            if self.check_events(scope):
+                return None
+            self.logger.info(f"NZB found: {nzb_title} ({candidate['title']} from {candidate['indexer']})")
+            self.events.publish(events.METHOD_CHOSEN, track_id, nzb_title, playlist=playlist_name, method="usenet")
+            with self.tracer.span("nzb", nzb_title=nzb_title, release=candidate['title'], indexer=candidate['indexer'],
+                                  size=candidate.get('size')):
+                with self.tracer.span("enqueue"), self.pipeline.stage("enqueue"):
+                    # addurl is not idempotent: retrying after a read timeout or 5xx could enqueue the NZB twice.
+                    sab_response = services.send_to_sabnzbd(self.clients.session("sabnzbd", idempotent=False), candidate['url'], nzb_title, self.env['SABNZBD_URL'], self.env['SABNZBD_API_KEY'], self.env['SABNZBD_CAT'], self.logger)
+                nzo_ids = (sab_response or {}).get("nzo_ids") or []
+                if nzo_ids:
+                    self.journal.record(track_id, journal.QUEUED, playlist=playlist_name, nzo_id=nzo_ids[0], nzb_title=nzb_title)
+
+                with self.tracer.span("sab_wait", nzo_id=nzo_ids[0] if nzo_ids else None) as span, self.pipeline.stage("wait"):
+                    src_folder, ext = self.wait_for_sabnzbd(sab_response, nzb_title, scope, track_id=track_id)
+                    span.set(ext=ext)
+                if self.interrupted(scope, track_id):
+                    return None
                 if ext:
-                    file_handler.move_and_rename_downloaded_file(nzb_title, artist_file_str, title_str, ext, self.env['DOWNLOAD_DIR'], self.env['CLEAN_DIR'], self.logger)
-                    
-                    final_ext = "ogg" if ext == "flac" else ext
-                    if file_handler.check_if_song_exists(artist_file_str, title_str, self.env['CLEAN_DIR'], self.logger, ext=final_ext):
-                        utils.save_to_song_archive(self.song_archive_path, track_id, self.logger)
-                        self.song_archive.add(track_id)
-                        file_handler.create_and_add_to_m3u(playlist_name, artist_file_str, title_str, self.env['CLEAN_DIR'], self.logger, ext=final_ext)
-                        return True
+                    finished = self.finish_usenet_download(src_folder, ext, track_id, playlist_name, artist_file_str, title_str)
+                    if finished is not False:
+                        return finished
+        self.journal.remove(track_id)
         return False
 
-    def try_spotdl_download(self, track_id, artist_file_str, title_str, playlist_name):
-        if self.check_events():
+    def interrupted(self, scope, track_id):
+        """Checks for stop/skip after a wait. A skipped track is dropped from the run journal, a stopped one is kept for the next run."""
+        check_result = self.check_events(scope)
+        if check_result == "skip":
+            self.journal.remove(track_id)
+        return bool(check_result)
+
+    def finish_usenet_download(self, src_folder, ext, track_id, playlist_name, artist_file_str, title_str):
+        """Moves a finished SABnzbd download into the library and archives or converts it. Returns True on success."""
+        if ext == "flac":
+            # FLAC is converted straight out of the download folder, so the lossless file is never written to the library.
+            try:
+                flac_file = file_handler.find_audio_file(src_folder, ext)
+            except OSError as e:
+                self.logger.error(f"Error reading download folder '{src_folder}': {e}")
+                flac_file = None
+            if not flac_file:
+                return False
+            self.journal.record(track_id, journal.CONVERTING, playlist=playlist_name, path=flac_file)
+            self.transcode_download(flac_file, track_id, playlist_name, artist_file_str, title_str, src_folder=src_folder)
+            return True
+        with self.tracer.span("move", ext=ext) as span, self.pipeline.stage("move"):
+            final_file = file_handler.move_and_rename_downloaded_file(src_folder, artist_file_str, title_str, ext, self.env['CLEAN_DIR'],
+                                                                      self.logger, self.library_folders)
+            if final_file and self.tracer.enabled:
+                span.set(path=final_file, bytes=os.path.getsize(final_file))
+        if not final_file:
+            self.library_folders.prune([self.song_folder(artist_file_str, title_str)])
+            return False
+        final_ext = os.path.splitext(final_file)[1][1:]
+        with self.pipeline.stage("archive"):
+            self.library.add(artist_file_str, title_str, final_ext)
+            self.record_download(track_id, playlist_name, artist_file_str, title_str, final_ext, "usenet")
+        return True
+
+    def resume_usenet_download(self, track_id, artist_file_str, title_str, playlist_name, scope=None):
+        """Continues work recorded in the run journal by an earlier, interrupted run.
+
+        Returns True if the track was finished, None if it was stopped or
+        skipped and False if there was nothing to resume.
+        """
+        entry = self.journal.get(track_id)
+        if not entry:
+            return False
+        with self.tracer.span("resume", state=entry['state'], nzo_id=entry['nzo_id']):
+            return self.resume_journal_entry(entry, track_id, artist_file_str, title_str, playlist_name, scope)
+
+    def resume_journal_entry(self, entry, track_id, artist_file_str, title_str, playlist_name, scope):
+        if entry['state'] == journal.CONVERTING and entry['path'] and os.path.exists(entry['path']):
+            self.logger.info(f"Resuming conversion of '{artist_file_str} - {title_str}' from an earlier run.")
+            # Older runs moved the FLAC file into the library before converting it; only download folders are removed afterwards.
+            src_folder = os.path.dirname(entry['path'])
+            if not file_handler.is_inside(src_folder, self.env['DOWNLOAD_DIR']):
+                src_folder = None
+            self.transcode_download(entry['path'], track_id, playlist_name, artist_file_str, title_str, src_folder=src_folder)
+            return True
+
+        if entry['state'] == journal.QUEUED and entry['nzo_id']:
+            nzb_title = entry['nzb_title']
+            self.logger.info(f"Resuming SABnzbd-Job '{nzb_title}' from an earlier run.")
+            self.events.publish(events.METHOD_CHOSEN, track_id, nzb_title, playlist=playlist_name, method="usenet")
+            with self.pipeline.stage("wait"):
+                src_folder, ext = self.wait_for_sabnzbd({"nzo_ids": [entry['nzo_id']]}, nzb_title, scope, track_id=track_id)
+            if self.interrupted(scope, track_id):
+                return None
+            if not ext:
+                # SABnzbd may have finished the job and purged it from its history while we were down.
+                src_folder = os.path.join(self.env['DOWNLOAD_DIR'], nzb_title)
+                ext = file_handler.find_downloaded_audio(src_folder)
+                if ext:
+                    self.logger.info(f"Adopting completed download folder {src_folder}.")
+            if ext and self.finish_usenet_download(src_folder, ext, track_id, playlist_name, artist_file_str, title_str):
+                return True
+
+        self.journal.remove(track_id)
+        return False
+
+    def transcode_download(self, flac_file, track_id, playlist_name, artist_file_str, title_str, src_folder=None):
+        """Converts a downloaded FLAC file into the library in the background and archives the track once it is done.
+
+        The FLAC file, and src_folder if given, are deleted after a successful
+        conversion. On failure they are kept for the next run.
+        """
+        dst_file = file_handler.library_file_path(artist_file_str, title_str, self.transcoder.ext, self.env['CLEAN_DIR'], self.library_folders)
+
+        def on_done(output_file, error):
+            if error and (isinstance(error, InterruptedError) or self.control.stopped):
+                # Stopped: the journal entry stays, so the next run converts the FLAC file again.
+                self.logger.info(f"Conversion of '{flac_file}' was stopped, keeping the FLAC file for the next run.")
+                self.library_folders.prune([os.path.dirname(dst_file)])
+                self.events.publish(events.TRACK_SKIPPED, track_id, f"{artist_file_str} - {title_str}", playlist=playlist_name,
+                                    method="usenet", message="Conversion stopped")
+                return
+            if error:
+                self.logger.error(f"Conversion of '{flac_file}' failed, keeping the FLAC file: {error}")
+                self.library_folders.prune([os.path.dirname(dst_file)])
+                self.events.publish(events.TRACK_FAILED, track_id, f"{artist_file_str} - {title_str}", playlist=playlist_name,
+                                    method="usenet", message=f"Conversion failed: {error}")
+                return
+            if src_folder:
+                file_handler.remove_download_folder(src_folder, self.logger)
+            else:
+                try:
+                    os.remove(flac_file)
+                    self.logger.info(f"Removed original flac file: {flac_file}")
+                except OSError as e:
+                    self.logger.error(f"Error removing {flac_file}: {e}")
+            with self.pipeline.stage("archive"):
+                self.library.add(artist_file_str, title_str, self.transcoder.ext)
+                self.record_download(track_id, playlist_name, artist_file_str, title_str, self.transcoder.ext, "usenet")
+
+        self.transcoder.submit(flac_file, dst_file, on_done=on_done, cancel_scope=self.control.run_scope)
+
+    def search_usenet(self, query):
+        """Searches all indexers through the search cache. Returns the merged candidates, or None if there is no hit."""
+        found, candidates = self.search_cache.get(query)
+        if found:
+            if candidates is None:
+                self.logger.info(f"Cached: no NZB for '{query}'.")
+            return candidates
+
+        candidates, complete = self.indexers.search(query)
+        if complete:
+            self.search_cache.put(query, candidates or None, negative=not candidates)
+        return candidates or None
+
+    def wait_for_sabnzbd(self, sab_response, nzb_title, scope=None, track_id=None):
+        """Waits for the job created by addurl and returns (download folder, audio extension)."""
+        if not sab_response:
+            return None, None
+
+        nzo_ids = sab_response.get("nzo_ids") or []
+        if not nzo_ids:
+            self.logger.warning(f"SABnzbd returned no job id for '{nzb_title}'. Falling back to folder polling.")
+            ext = file_handler.wait_for_download_folder(nzb_title, self.env['DOWNLOAD_DIR'], self.logger, cancel_scope=scope)
+            return os.path.join(self.env['DOWNLOAD_DIR'], nzb_title), ext
+
+        def on_progress(percentage):
+            self.events.publish(events.TRACK_PROGRESS, track_id, nzb_title, method="usenet", percent=percentage)
+
+        job = self.sabnzbd.track(nzo_ids[0], nzb_title, on_progress=on_progress)
+        if not self.sabnzbd.wait(job, self.env['SABNZBD_JOB_TIMEOUT'], cancel_scope=scope):
+            return None, None
+
+        src_folder = file_handler.resolve_download_folder(job.storage, nzb_title, self.env['DOWNLOAD_DIR'])
+        ext = file_handler.find_downloaded_audio(src_folder) if src_folder else None
+        if ext:
+            self.logger.info(f"Found matching audio file in {src_folder} with extension {ext}.")
+        else:
+            self.logger.warning(f"SABnzbd-Job '{nzb_title}' completed, but no matching audio file was found in {job.storage}.")
+        return src_folder, ext
+
+    def try_spotdl_download(self, track_id, artist_file_str, title_str, playlist_name, scope=None):
+        """Queues the track for SpotDL and runs the batch once SPOTDL_BATCH_SIZE tracks are queued."""
+        check_result = self.check_events(scope)
+        if check_result == "skip":
+            self.events.publish(events.TRACK_SKIPPED, track_id, f"{artist_file_str} - {title_str}", playlist=playlist_name)
+        if check_result:
             return
+        self.logger.info(f"Queued for SpotDL: {artist_file_str} - {title_str}")
+        self.events.publish(events.METHOD_CHOSEN, track_id, f"{artist_file_str} - {title_str}", playlist=playlist_name, method="spotdl")
+        with self._spotdl_lock:
+            self._spotdl_queue.append((track_id, artist_file_str, title_str, playlist_name))
+            if len(self._spotdl_queue) < self.env['SPOTDL_BATCH_SIZE']:
+                return
+            batch, self._spotdl_queue = self._spotdl_queue, []
+        self.run_spotdl_batch(batch)
+
+    def flush_spotdl_queue(self):
+        with self._spotdl_lock:
+            batch, self._spotdl_queue = self._spotdl_queue, []
+        if batch:
+            self.run_spotdl_batch(batch)
+
+    def run_spotdl_batch(self, batch):
+        """Downloads a batch with one spotdl process. Only stopping the run terminates it; skip does not cancel a whole batch."""
+        staging_dir = tempfile.mkdtemp(prefix=".spotdl-", dir=self.env['CLEAN_DIR'])
         try:
-            services.download_with_spotdl(track_id, artist_file_str, title_str, self.env['CLEAN_DIR'], self.logger)
-            
-            if file_handler.check_if_song_exists(artist_file_str, title_str, self.env['CLEAN_DIR'], self.logger, ext="ogg"):
-                utils.save_to_song_archive(self.song_archive_path, track_id, self.logger)
-                self.song_archive.add(track_id)
-                file_handler.create_and_add_to_m3u(playlist_name, artist_file_str, title_str, self.env['CLEAN_DIR'], self.logger, ext="ogg")
-        except Exception as e:
-            self.logger.error(f"SpotDL download failed for '{artist_file_str} - {title_str}': {e}")
+            with self.tracer.span("spotdl", tracks=len(batch)) as span, self.pipeline.stage("spotdl"), \
+                    self.control.track(f"SpotDL batch of {len(batch)} tracks", skippable=False) as scope:
+                self.logger.info(f"Downloading with SpotDL: {len(batch)} tracks")
+                downloaded, errors = services.download_with_spotdl([entry[0] for entry in batch], staging_dir, self.logger,
+                                                                   threads=self.env['SPOTDL_THREADS'], cancel_scope=scope,
+                                                                   spotdl_bin=self.env['SPOTDL_BIN'])
+                span.set(downloaded=len(downloaded), errors=len(errors))
 
-    def download_each_playlist(self):
-        if self.check_events():
-            return
+            for track_id, artist_file_str, title_str, playlist_name in batch:
+                label = f"{artist_file_str} - {title_str}"
+                src_file = downloaded.get(track_id)
+                if not src_file and scope.cancelled:
+                    # Stopped: the track is downloaded by the next run.
+                    continue
+                if not src_file:
+                    reason = next((line for line in errors if track_id in line or label in line), "no file was produced")
+                    self.logger.error(f"SpotDL download failed for '{label}': {reason}")
+                    self.events.publish(events.TRACK_FAILED, track_id, label, playlist=playlist_name, method="spotdl", message=reason)
+                    continue
+                try:
+                    file_handler.place_in_library(src_file, artist_file_str, title_str, "ogg", self.env['CLEAN_DIR'], self.logger,
+                                                  self.library_folders)
+                except OSError as e:
+                    self.logger.error(f"Error moving SpotDL download for '{label}': {e}")
+                    self.library_folders.prune([self.song_folder(artist_file_str, title_str)])
+                    self.events.publish(events.TRACK_FAILED, track_id, label, playlist=playlist_name, method="spotdl", message=str(e))
+                    continue
+                self.logger.info(f"Successfully downloaded '{artist_file_str} - {title_str}.ogg'")
+                with self.pipeline.stage("archive"):
+                    self.library.add(artist_file_str, title_str, "ogg")
+                    self.record_download(track_id, playlist_name, artist_file_str, title_str, "ogg", "spotdl")
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def read_playlist_urls(self):
+        file_path = os.path.join(self.env["SPOTIFY_PLAYLISTS_PATH"], 'playlists.txt')
+        with open(file_path, "r") as f:
+            return [line.strip() for line in f if line.strip().startswith("https://open.spotify.com/")]
+
+    def sync_playlist(self, playlist_id):
+        """Resolves a playlist, reusing the stored track list while its snapshot_id is unchanged.
+
+        Returns a dict with the playlist name, all tracks and the added/removed
+        tracks since the last sync, or None if the playlist could not be fetched.
+        The new snapshot is stored by download_each_playlist once the playlist
+        has been processed.
+        """
+        snapshot = services.get_playlist_snapshot(self.clients.spotify, playlist_id, self.logger)
+        if snapshot is None:
+            return None
+
+        state = self.playlist_state.get(playlist_id)
+        if state and state.get('snapshot_id') == snapshot['snapshot_id']:
+            self.logger.info(f"Playlist '{snapshot['name']}' is unchanged since the last sync.")
+            return {'id': playlist_id, 'snapshot_id': snapshot['snapshot_id'], 'name': snapshot['name'], 'tracks': state['tracks'],
+                    'added': [], 'removed': [], 'changed': False}
+
+        playlist_name, tracks = services.find_playlist_tracks(self.clients.spotify, playlist_id, self.logger, snapshot=snapshot)
+        if tracks is None:
+            return None
+
+        if state:
+            added, removed = diff_tracks(state['tracks'], tracks)
+            self.logger.info(f"Playlist '{playlist_name}' changed: {len(added)} tracks added, {len(removed)} removed.")
+        else:
+            added, removed = tracks, []
+        return {'id': playlist_id, 'snapshot_id': snapshot['snapshot_id'], 'name': playlist_name, 'tracks': tracks,
+                'added': added, 'removed': removed, 'changed': True}
+
+    def plan_playlists(self):
+        """Syncs all configured playlists and returns one plan per playlist.
+
+        A plan holds the playlist name, all of its tracks in Spotify order, the
+        newly added tracks, the tracks that need processing ("work") and whether
+        the playlist changed.
+        """
         try:
-            file_path = os.path.join(self.env["SPOTIFY_PLAYLISTS_PATH"], 'playlists.txt')
-            with open(file_path, "r") as f:
-                playlists = [line.strip() for line in f if line.strip().startswith("https://open.spotify.com/")]
+            playlists = self.read_playlist_urls()
         except Exception as e:
             self.logger.error(f"Error reading playlists file: {e}")
-            return
+            return []
 
         if not playlists:
             self.logger.error("No playlists found in the file.")
-            return
+            return []
 
+        pending = self.journal.pending()
+        if pending:
+            self.logger.info(f"Run journal: {len(pending)} tracks were in flight when the last run ended and will be resumed.")
+        self.journal.prune()
+
+        plans = []
         for playlist_url in playlists:
-            self.logger.info(f"Begin processing playlist: {playlist_url}")
+            if self.stop_requested():
+                break
             playlist_id = playlist_url.split('/')[-1].split('?')[0]
-            playlist_name, tracks = services.find_playlist_tracks(playlist_id, self.env['SPOTIFY_CLIENT_ID'], self.env['SPOTIFY_CLIENT_SECRET'], self.logger)
-            if tracks:
-                self.download_tracks(tracks, playlist_name)
+            sync = self.sync_playlist(playlist_id)
+            if sync is None:
+                self.logger.error(f"Skipping playlist {playlist_url}: it could not be fetched from Spotify.")
+                continue
+
+            if sync['removed']:
+                removed = [(', '.join(artist['name'] for artist in item['track']['artists']), item['track']['name']) for item in sync['removed']]
+                self.m3u.remove(sync['name'], removed)
+
+            # Tracks that were not archived yet are retried even if the playlist did not change.
+            added_ids = {item['track']['id'] for item in sync['added']}
+            work = list(sync['added']) + [item for item in sync['tracks'] if item['track']['id'] not in added_ids and item['track']['id'] not in self.song_archive]
+            self.logger.info(f"Playlist '{sync['name']}': {len(work)} of {len(sync['tracks'])} tracks need processing.")
+            plans.append({'id': sync['id'], 'snapshot_id': sync['snapshot_id'], 'name': sync['name'], 'tracks': sync['tracks'],
+                          'added': sync['added'], 'work': work, 'changed': sync['changed']})
+        return plans
+
+    def build_work_queue(self, plans):
+        """Merges the work of all plans into one queue of unique tracks.
+
+        Each entry holds the playlist item and the names of all playlists that
+        contain the track. Tracks newly added to a playlist come first, then
+        tracks of the playlists with the least work, so that whole playlists
+        become usable as early as possible.
+        """
+        entries = {}
+        for index, plan in enumerate(plans):
+            added_ids = {item['track']['id'] for item in plan['added']}
+            for item in plan['work']:
+                track_id = item['track']['id']
+                entry = entries.setdefault(track_id, {'item': item, 'playlists': [], 'new': False, 'rank': None})
+                entry['playlists'].append(plan['name'])
+                entry['new'] = entry['new'] or track_id in added_ids
+                rank = (len(plan['work']), index)
+                if entry['rank'] is None or rank < entry['rank']:
+                    entry['rank'] = rank
+                    # The playlist that is completed first comes first and is used for progress events.
+                    entry['playlists'].insert(0, entry['playlists'].pop())
+
+        queue = sorted(entries.values(), key=lambda entry: (not entry['new'], entry['rank']))
+        shared = sum(1 for entry in queue if len(entry['playlists']) > 1)
+        self.logger.info(f"Work queue: {len(queue)} unique tracks from {sum(len(plan['work']) for plan in plans)} "
+                         f"playlist entries, {shared} shared by several playlists.")
+        return [{'item': entry['item'], 'playlists': entry['playlists']} for entry in queue]
+
+    def download_each_playlist(self, plans=None, queue=None):
+        if self.check_events():
+            return
+        if plans is None:
+            plans = self.plan_playlists()
+        if queue is None:
+            queue = self.build_work_queue(plans)
+
+        self._memberships = {entry['item']['track']['id']: entry['playlists'] for entry in queue}
+        try:
+            if queue:
+                self.download_tracks(queue)
+            self.transcoder.drain()
+            for plan in plans:
+                if plan['work'] or plan['changed']:
+                    self.finalize_playlist(plan)
+                # The new snapshot is stored only once the playlist was fully processed, so an interrupted run diffs it again.
+                if plan['changed'] and not self.stop_requested():
+                    self.playlist_state.save(plan['id'], plan['snapshot_id'], plan['name'], plan['tracks'])
+        finally:
+            self._memberships = {}
+
+    def finalize_playlist(self, plan):
+        """Rewrites the playlist's .m3u file in Spotify order, dropping tracks no longer in the playlist."""
+        entries = []
+        for item in plan['tracks']:
+            track = item['track']
+            artist_file_str = ', '.join(artist['name'] for artist in track['artists'])
+            entry = self.m3u.find(plan['name'], artist_file_str, track['name'])
+            if entry:
+                entries.append(entry)
+        self.m3u.rewrite(plan['name'], entries)
+
+    def close(self):
+        self.sabnzbd.close()
+        self.transcoder.drain()
+        self.transcoder.shutdown(cancel_pending=self.control.stopped)
+        self.library_folders.prune()
+        self.m3u.flush()
+        self.library.save()
+        self.search_cache.close()
+        self.indexers.close()
+        if self._owns_clients:
+            self.clients.close()
+        self.journal.close()
+        self.song_archive.compact(min_interval=self.env['ARCHIVE_COMPACT_INTERVAL'])
+        self.song_archive.close()
+        self.tracer.close()
+
+    def song_folder(self, artist_file_str, title_str):
+        return os.path.join(self.env['CLEAN_DIR'], artist_file_str, title_str)
 
-    def remove_empty_folders(self):
+    def remove_empty_folders(self, cancel_scope=None):
+        """Sweeps the whole clean directory for empty folders. Runs clean up their own folders; this is a maintenance job."""
         self.logger.info("Removing empty folders in the clean directory...")
-        file_handler.remove_empty_folders(self.env['CLEAN_DIR'], self.logger)
\ No newline at end of file
+        return file_handler.remove_empty_folders(self.env['CLEAN_DIR'], self.logger, rate=self.env['FOLDER_CLEANUP_RATE'],
+                                                 cancel_scope=cancel_scope)
\ No newline at end of file
@@ -0,0 +1,64 @@
+import threading
+
+TRACK_STARTED = "track_started"
+METHOD_CHOSEN = "method_chosen"
+TRACK_PROGRESS = "track_progress"
+TRACK_COMPLETED = "track_completed"
+TRACK_FAILED = "track_failed"
+TRACK_SKIPPED = "track_skipped"
+
+class ProgressEvent:
+    """A progress notification for one track.
+
+    kind is one of the constants above. method names the download source
+    ("usenet", "spotdl" or "archive"), percent is set for TRACK_PROGRESS and
+    message carries a short reason for failures and skips.
+    """
+
+    __slots__ = ("kind", "track_id", "label", "playlist", "method", "percent", "message")
+
+    def __init__(self, kind, track_id=None, label="", playlist=None, method=None, percent=None, message=""):
+        self.kind = kind
+        self.track_id = track_id
+        self.label = label
+        self.playlist = playlist
+        self.method = method
+        self.percent = percent
+        self.message = message
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class EventBus:
+    """Delivers progress events synchronously to every subscriber.
+
+    Subscribers run on the publishing thread and must be quick; a failing
+    subscriber is logged and does not affect the download.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def publish(self, kind, track_id=None, label="", **fields):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        if not subscribers:
+            return
+        event = ProgressEvent(kind, track_id, label, **fields)
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                self.logger.error(f"Error in progress event subscriber: {e}")
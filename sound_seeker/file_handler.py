@@ -1,99 +1,288 @@
+import errno
 import os
 import shutil
-import glob
 import time
 import subprocess
+import threading
+import uuid
+from . import metrics
+from .ratelimit import TokenBucket
 
-def convert_flac_to_ogg(src_file, dst_file, logger, bitrate="320k"):
+# copy_file_range fails with these when the kernel or filesystem cannot copy between the two files.
+COPY_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF, errno.EPERM}
+
+def run_process(cmd, cancel_scope=None):
+    """Runs cmd to completion and returns (return code, stdout, stderr).
+
+    The process is terminated as soon as cancel_scope is cancelled.
+    """
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if cancel_scope is None:
+        stdout, stderr = process.communicate()
+    else:
+        with cancel_scope.attach_process(process):
+            stdout, stderr = process.communicate()
+    return process.returncode, stdout, stderr
+
+def temp_path_for(dst_file):
+    """Returns an unused hidden file name next to dst_file with the same extension.
+
+    Writing there and renaming onto dst_file keeps the data on the target
+    filesystem and never exposes a half-written file under the final name.
+    """
+    directory, name = os.path.split(dst_file)
+    stem, ext = os.path.splitext(name)
+    return os.path.join(directory, f".{stem}.{uuid.uuid4().hex[:8]}.part{ext}")
+
+def transcode_audio(src_file, dst_file, logger, codec="libvorbis", bitrate="320k", cancel_scope=None, ffmpeg_bin="ffmpeg"):
+    """Converts src_file into a temporary file next to dst_file and renames it onto dst_file once ffmpeg succeeded."""
+    if cancel_scope and cancel_scope.cancelled:
+        raise InterruptedError(f"Conversion of {src_file} was cancelled.")
+    tmp_file = temp_path_for(dst_file)
+    cmd = [ffmpeg_bin, "-y", "-i", src_file, "-c:a", codec, "-b:a", bitrate, tmp_file]
     try:
-        cmd = ["ffmpeg", "-y", "-i", src_file, "-c:a", "libvorbis", "-b:a", bitrate, dst_file]
-        subprocess.run(cmd, check=True, capture_output=True, text=True)
-        logger.info(f"Converting {src_file} to {dst_file} completed successfully.")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"ffmpeg conversion error: {e.stderr}")
+        with metrics.STAGE_SECONDS.time(stage="transcode"):
+            return_code, _, stderr = run_process(cmd, cancel_scope)
+        if cancel_scope and cancel_scope.cancelled:
+            raise InterruptedError(f"Conversion of {src_file} was cancelled.")
+        if return_code != 0:
+            logger.error(f"ffmpeg conversion error: {stderr}")
+            raise subprocess.CalledProcessError(return_code, cmd, stderr=stderr)
+        os.replace(tmp_file, dst_file)
+    except BaseException:
+        remove_quietly(tmp_file)
         raise
+    metrics.BYTES.inc(os.path.getsize(src_file), operation="transcode")
+    logger.info(f"Converting {src_file} to {dst_file} completed successfully.")
 
-def move_and_rename_downloaded_file(nzb_title, artist, title, ext, download_dir, clean_dir, logger):
-    src_folder = os.path.join(download_dir, nzb_title)
-    artist_dir = os.path.join(clean_dir, artist)
-    song_dir = os.path.join(artist_dir, title)
-    os.makedirs(song_dir, exist_ok=True)
-    
+def is_up_to_date(src_file, dst_file):
+    """Returns True if dst_file exists and is not older than src_file."""
+    try:
+        return os.path.getmtime(dst_file) >= os.path.getmtime(src_file)
+    except OSError:
+        return False
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def copy_file_contents(src_fd, dst_fd, size):
+    """Copies size bytes between two open files inside the kernel.
+
+    Uses copy_file_range, which lets filesystems such as NFS 4.2, XFS or
+    Btrfs copy server-side or share extents, then sendfile, and only reads
+    the data into Python if neither is supported for these files.
+    """
+    copy_file_range = getattr(os, "copy_file_range", None)
+    use_sendfile = hasattr(os, "sendfile")
+    offset = 0
+    while offset < size:
+        try:
+            if copy_file_range:
+                copied = copy_file_range(src_fd, dst_fd, size - offset, offset)
+            elif use_sendfile:
+                copied = os.sendfile(dst_fd, src_fd, offset, size - offset)
+            else:
+                os.lseek(src_fd, offset, os.SEEK_SET)
+                copied = os.write(dst_fd, os.read(src_fd, min(size - offset, 1024 * 1024)))
+        except OSError as e:
+            if e.errno not in COPY_FALLBACK_ERRNOS or not (copy_file_range or use_sendfile):
+                raise
+            if copy_file_range:
+                copy_file_range = None
+            else:
+                use_sendfile = False
+            continue
+        if copied == 0:
+            break
+        offset += copied
+
+def move_file(src_file, dst_file):
+    """Moves src_file onto dst_file atomically. Returns True if it was a rename, False if it had to be copied.
+
+    On the same filesystem this is a rename. Across filesystems the data is
+    copied in the kernel into a temporary file next to dst_file, which is
+    renamed into place before src_file is removed.
+    """
+    try:
+        os.replace(src_file, dst_file)
+        return True
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    tmp_file = temp_path_for(dst_file)
+    try:
+        with open(src_file, "rb") as src, open(tmp_file, "xb") as dst:
+            copy_file_contents(src.fileno(), dst.fileno(), os.fstat(src.fileno()).st_size)
+        shutil.copystat(src_file, tmp_file)
+        os.replace(tmp_file, dst_file)
+    except BaseException:
+        remove_quietly(tmp_file)
+        raise
+    os.remove(src_file)
+    return False
+
+class LibraryFolders:
+    """Song folders created in the clean directory during a run.
+
+    make() creates a folder and remembers it, so prune() only has to look at
+    those folders and their parents instead of walking the whole library.
+    Both hold the same lock, so a folder cannot be pruned while another
+    track is creating it.
+    """
+
+    def __init__(self, clean_dir, logger):
+        self.clean_dir = os.path.abspath(clean_dir)
+        self.logger = logger
+        self._touched = set()
+        self._lock = threading.Lock()
+
+    def make(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            os.makedirs(path, exist_ok=True)
+            self._touched.add(path)
+
+    def prune(self, paths=None):
+        """Removes the given touched folders, or all of them, and their parents up to the clean directory if they are empty.
+
+        Returns the number of folders removed.
+        """
+        removed = 0
+        with self._lock:
+            paths = set(self._touched) if paths is None else {os.path.abspath(path) for path in paths} & self._touched
+            self._touched -= paths
+            candidates = set()
+            for path in paths:
+                while is_inside(path, self.clean_dir) and path not in candidates:
+                    candidates.add(path)
+                    path = os.path.dirname(path)
+            # Deepest first, so a parent is tried after its children are gone.
+            for path in sorted(candidates, key=lambda path: path.count(os.sep), reverse=True):
+                if remove_folder_if_empty(path, self.logger):
+                    removed += 1
+        return removed
+
+def remove_folder_if_empty(path, logger):
+    """Removes path if it is an empty folder. rmdir refuses non-empty folders, so no listing is needed."""
+    try:
+        os.rmdir(path)
+    except OSError as e:
+        if e.errno not in (errno.ENOTEMPTY, errno.EEXIST, errno.ENOENT):
+            logger.error(f"Error while removing {path}: {e}")
+        return False
+    logger.info(f"Removed folder: {path}")
+    return True
+
+def library_file_path(artist, title, ext, clean_dir, folders=None):
+    """Returns Artist/Title/"Artist - Title.ext" in the clean directory and creates its folder, recording it in folders."""
+    song_dir = os.path.join(clean_dir, artist, title)
+    if folders:
+        folders.make(song_dir)
+    else:
+        os.makedirs(song_dir, exist_ok=True)
+    return os.path.join(song_dir, f"{artist} - {title}.{ext}")
+
+def place_in_library(src_file, artist, title, ext, clean_dir, logger, folders=None):
+    """Moves a file to Artist/Title/"Artist - Title.ext" in the clean directory and returns the new path."""
+    final_dst_file = library_file_path(artist, title, ext, clean_dir, folders)
+    size = os.path.getsize(src_file)
+    renamed = move_file(src_file, final_dst_file)
+    metrics.BYTES.inc(size, operation="move" if renamed else "copy")
+    logger.info(f"{'Moved' if renamed else 'Copied'} and renamed: {src_file} -> {final_dst_file}")
+    return final_dst_file
+
+def is_inside(path, directory):
+    """Returns True if path is below directory (and not directory itself)."""
+    path, directory = os.path.abspath(path), os.path.abspath(directory)
+    return path != directory and os.path.commonpath([path, directory]) == directory
+
+def find_audio_file(src_folder, ext):
+    """Returns the path of the first file with the given extension in src_folder, or None."""
+    for file in os.listdir(src_folder):
+        if file.lower().endswith(f".{ext}"):
+            return os.path.join(src_folder, file)
+    return None
+
+def remove_download_folder(src_folder, logger):
     try:
-        for file in os.listdir(src_folder):
-            if file.lower().endswith(f".{ext}"):
-                src_file = os.path.join(src_folder, file)
-                final_filename_base = f"{artist} - {title}"
-                
-                if ext == "flac":
-                    temp_dst_file = os.path.join(song_dir, f"{final_filename_base}.flac")
-                    final_dst_file = os.path.join(song_dir, f"{final_filename_base}.ogg")
-                    shutil.move(src_file, temp_dst_file)
-                    logger.info(f"Moved: {src_file} -> {temp_dst_file}")
-                    convert_flac_to_ogg(temp_dst_file, final_dst_file, logger)
-                    os.remove(temp_dst_file)
-                    logger.info(f"Removed original flac file: {temp_dst_file}")
-                else:
-                    final_dst_file = os.path.join(song_dir, f"{final_filename_base}.{ext}")
-                    shutil.move(src_file, final_dst_file)
-                    logger.info(f"Moved and renamed: {src_file} -> {final_dst_file}")
-                
-                shutil.rmtree(src_folder)
-                logger.info(f"SABnzbd-Folder deleted: {src_folder}")
-                return ext
+        shutil.rmtree(src_folder)
+        logger.info(f"SABnzbd-Folder deleted: {src_folder}")
+    except OSError as e:
+        logger.error(f"Error while removing/deleting '{src_folder}': {e}")
+
+def move_and_rename_downloaded_file(src_folder, artist, title, ext, clean_dir, logger, folders=None):
+    try:
+        src_file = find_audio_file(src_folder, ext)
+        if src_file:
+            final_dst_file = place_in_library(src_file, artist, title, ext, clean_dir, logger, folders)
+            remove_download_folder(src_folder, logger)
+            return final_dst_file
     except Exception as e:
-        logger.error(f"Error while removing/deleting '{nzb_title}': {e}")
+        logger.error(f"Error while removing/deleting '{src_folder}': {e}")
+
+def find_downloaded_audio(src_folder, exts=("flac", "mp3")):
+    """Returns the preferred audio extension present in src_folder, or None."""
+    try:
+        names = os.listdir(src_folder)
+    except OSError:
+        return None
+    for ext in exts:
+        if any(name.lower().endswith(f".{ext}") for name in names):
+            return ext
+    return None
+
+def resolve_download_folder(storage, nzb_title, download_dir):
+    """Maps the storage path reported by SABnzbd to a folder visible to us."""
+    candidates = []
+    if storage:
+        candidates += [storage, os.path.join(download_dir, os.path.basename(os.path.normpath(storage)))]
+    candidates.append(os.path.join(download_dir, nzb_title))
+    for folder in candidates:
+        if os.path.isdir(folder):
+            return folder
+    return None
 
-def wait_for_download_folder(nzb_title, download_dir, logger, exts=("flac", "mp3"), timeout=60, poll_interval=2):
+def wait_for_download_folder(nzb_title, download_dir, logger, exts=("flac", "mp3"), timeout=60, poll_interval=2, cancel_scope=None):
     src_folder = os.path.join(download_dir, nzb_title)
     start_time = time.time()
     while time.time() - start_time < timeout:
-        if os.path.exists(src_folder):
-            for ext in exts:
-                if glob.glob(os.path.join(src_folder, f"*.{ext}")):
-                    logger.info(f"Found matching audio file in {src_folder} with extension {ext}.")
-                    return ext
-        time.sleep(poll_interval)
+        ext = find_downloaded_audio(src_folder, exts)
+        if ext:
+            logger.info(f"Found matching audio file in {src_folder} with extension {ext}.")
+            return ext
+        if cancel_scope is None:
+            time.sleep(poll_interval)
+        elif cancel_scope.sleep(poll_interval):
+            return None
     logger.warning(f"Timeout: No matching audio file found in {src_folder} after {timeout} seconds.")
     return None
 
-def create_and_add_to_m3u(playlist_name, artist, title, clean_dir, logger, ext="ogg"):
-    try:
-        m3u_file = os.path.join(clean_dir, f"{playlist_name}.m3u")
-        track_path = os.path.join(artist, title, f"{artist} - {title}.{ext}")
-        
-        if os.path.exists(m3u_file):
-            with open(m3u_file, "r", encoding="utf-8") as f:
-                if f"{track_path}\n" in f.readlines():
-                    logger.info(f"'{artist} - {title}' is already in {playlist_name}.m3u. Skipping addition.")
-                    return
-
-        with open(m3u_file, "a", encoding="utf-8") as f:
-            f.write(f"{track_path}\n")
-        logger.info(f"'{artist} - {title}' added to {m3u_file}.")
-    except Exception as e:
-        logger.error(f"Error while adding to M3U file: {e}")
+def remove_empty_folders(clean_dir, logger, rate=0, cancel_scope=None):
+    """Removes every empty folder below clean_dir, scanning at most `rate` folders per second (0 for no limit).
 
-def remove_empty_folders(clean_dir, logger):
+    This walks the whole library and is meant as an occasional maintenance
+    job; runs only prune the folders they created (see LibraryFolders).
+    Returns the number of folders removed.
+    """
     if not os.path.isdir(clean_dir):
         logger.warning(f"{clean_dir} not found or is not a directory.")
-        return
+        return 0
+    bucket = TokenBucket(rate)
+    removed = set()
+    scanned = 0
     for root, dirs, files in os.walk(clean_dir, topdown=False):
-        for name in dirs:
-            dir_path = os.path.join(root, name)
-            if not os.listdir(dir_path):
-                try:
-                    os.rmdir(dir_path)
-                    logger.info(f"Removed folder: {dir_path}")
-                except OSError as e:
-                    logger.error(f"Error while removing {dir_path}: {e}")
-            
-def check_if_song_exists(artist, title, clean_dir, logger, ext="ogg"):
-    """Checks if the final song file exists in the clean directory."""
-    expected_path = os.path.join(clean_dir, artist, title, f"{artist} - {title}.{ext}")
-    if os.path.exists(expected_path):
-        logger.info(f"Confirmed song file exists at: {expected_path}")
-        return True
-    else:
-        logger.warning(f"Song file not found at expected path: {expected_path}. Skipping addition to .m3u and to songarchive. This song will be downloaded again next time.")
-        return False
+        if cancel_scope and cancel_scope.cancelled:
+            logger.info(f"Empty folder cleanup cancelled after {scanned} folders.")
+            break
+        bucket.acquire()
+        scanned += 1
+        # Bottom-up, the children of root were handled already: it is empty if it has no files and all its folders are gone.
+        if root != clean_dir and not files and all(os.path.join(root, name) in removed for name in dirs):
+            if remove_folder_if_empty(root, logger):
+                removed.add(root)
+    logger.info(f"Empty folder cleanup scanned {scanned} folders and removed {len(removed)}.")
+    return len(removed)
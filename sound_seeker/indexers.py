@@ -0,0 +1,164 @@
+import re
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from rapidfuzz import fuzz
+from . import services
+from .control import bind_scope, current_scope
+
+LOSSLESS_CATEGORY = "3040"
+MP3_CATEGORY = "3010"
+# Rough bytes per second of audio, used to tell single tracks from full albums.
+BYTES_PER_SECOND = {"flac": 110000, "mp3": 40000}
+DEFAULT_DURATION_MS = 240000
+
+class NewznabIndexer:
+    def __init__(self, name, api_url, api_key, session, logger, timeout=15, max_results=None):
+        self.name = name
+        self.api_url = api_url
+        self.api_key = api_key
+        self.session = session
+        self.logger = logger
+        self.timeout = timeout
+        self.max_results = max_results
+
+    def search(self, query):
+        """Returns a list of candidates, or None if the indexer could not be queried."""
+        return services.search_newznab(self.session, self.api_url, self.api_key, query, self.logger,
+                                       timeout=self.timeout, indexer_name=self.name, max_results=self.max_results)
+
+def parse_extra_indexers(value):
+    """Parses EXTRA_INDEXERS: "name|api url|api key" entries separated by ';'."""
+    indexers = []
+    for entry in filter(None, (part.strip() for part in value.split(";"))):
+        fields = [field.strip() for field in entry.split("|")]
+        if len(fields) != 3 or not all(fields):
+            raise ValueError(f"Invalid EXTRA_INDEXERS entry '{entry}' (expected 'name|api url|api key')")
+        indexers.append(tuple(fields))
+    return indexers
+
+def normalize_title(text):
+    return " ".join(re.sub(r"[\W_]+", " ", text.lower()).split())
+
+def dedupe_candidates(candidates):
+    """Drops releases posted to several indexers, keeping the first occurrence."""
+    seen = set()
+    unique = []
+    for candidate in candidates:
+        size_mb = candidate['size'] // 1048576 if candidate.get('size') else None
+        key = (normalize_title(candidate['title']), size_mb)
+        if key not in seen:
+            seen.add(key)
+            unique.append(candidate)
+    return unique
+
+def candidate_format(candidate):
+    """Returns (format, score) guessed from the newznab category and the release title."""
+    category = str(candidate.get('attrs', {}).get('category', ''))
+    title = candidate['title'].lower()
+    if category == LOSSLESS_CATEGORY or "flac" in title:
+        return "flac", 1.0
+    if "320" in title:
+        return "mp3", 0.7
+    if category == MP3_CATEGORY or "mp3" in title:
+        return "mp3", 0.5
+    return "mp3", 0.3
+
+def size_score(candidate, audio_format, duration_ms):
+    if not candidate.get('size'):
+        return 0.5
+    expected = BYTES_PER_SECOND[audio_format] * (duration_ms or DEFAULT_DURATION_MS) / 1000
+    ratio = candidate['size'] / expected
+    if ratio < 0.5:
+        return ratio / 0.5
+    if ratio <= 2.5:
+        return 1.0
+    # Much larger than one track: most likely a full album or discography.
+    return max(0.0, 1.0 - (ratio - 2.5) / 10)
+
+def age_score(candidate, now=None):
+    try:
+        posted = parsedate_to_datetime(candidate['pubdate'])
+    except (KeyError, TypeError, ValueError):
+        return 0.5
+    if posted.tzinfo is None:
+        posted = posted.replace(tzinfo=timezone.utc)
+    age_days = ((now or datetime.now(timezone.utc)) - posted).days
+    return max(0.0, 1.0 - age_days / 3650)
+
+def rank_candidates(candidates, artist, title, duration_ms=None, min_similarity=60):
+    """Sorts candidates by title similarity, format (FLAC > 320 MP3 > MP3), plausible size and age.
+
+    Candidates whose title is less than min_similarity (0-100) similar to
+    "artist title", or that do not contain the track title, are dropped.
+    """
+    target = normalize_title(f"{artist} {title}")
+    title = normalize_title(title)
+    scored = []
+    for candidate in candidates:
+        release = normalize_title(candidate['title'])
+        similarity = min(fuzz.token_set_ratio(target, release), fuzz.partial_ratio(title, release))
+        if similarity < min_similarity:
+            continue
+        audio_format, format_score = candidate_format(candidate)
+        score = (0.5 * similarity / 100 + 0.25 * format_score
+                 + 0.15 * size_score(candidate, audio_format, duration_ms) + 0.1 * age_score(candidate))
+        scored.append((score, candidate))
+    scored.sort(key=lambda entry: entry[0], reverse=True)
+    return [candidate for _, candidate in scored]
+
+class IndexerSearch:
+    """Queries every configured newznab indexer in parallel and merges the results.
+
+    Each indexer gets `timeout` seconds; slower indexers are skipped for that
+    query, so a search takes as long as the slowest indexer that answers.
+    """
+
+    def __init__(self, indexers, logger, timeout=15, max_workers=None):
+        self.indexers = indexers
+        self.logger = logger
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or max(1, len(indexers)), thread_name_prefix="indexer")
+
+    @classmethod
+    def from_env(cls, env, clients, logger):
+        timeout = env['INDEXER_TIMEOUT']
+        max_results = env['INDEXER_MAX_RESULTS']
+        # Every indexer gets its own session, so RATE_LIMIT_INDEXER applies to each of them rather than to the whole fan-out.
+        indexers = [NewznabIndexer("SceneNZBs", env['SCENENZBS_URL'], env['SCENENZBS_API_KEY'], clients.session("indexer", "SceneNZBs"),
+                                   logger, timeout, max_results)]
+        for name, api_url, api_key in parse_extra_indexers(env['EXTRA_INDEXERS']):
+            indexers.append(NewznabIndexer(name, api_url, api_key, clients.session("indexer", name), logger, timeout, max_results))
+        return cls(indexers, logger, timeout=timeout, max_workers=len(indexers) * env['PIPELINE_SEARCH_LIMIT'])
+
+    def search(self, query):
+        """Returns (candidates, complete). complete is False if an indexer failed or timed out."""
+        scope = current_scope()
+
+        def search(indexer):
+            # Runs on a pool thread; binding the caller's scope lets stop and skip cut rate-limit waits short.
+            with bind_scope(scope):
+                return indexer.search(query)
+
+        futures = [(indexer, self._executor.submit(search, indexer)) for indexer in self.indexers]
+        wait([future for _, future in futures], timeout=self.timeout)
+
+        candidates = []
+        complete = True
+        for indexer, future in futures:
+            if not future.done():
+                future.cancel()
+                self.logger.warning(f"Indexer {indexer.name} did not answer within {self.timeout} seconds.")
+                complete = False
+                continue
+            results = future.result()
+            if results is None:
+                complete = False
+                continue
+            for candidate in results:
+                candidate['indexer'] = indexer.name
+            candidates.extend(results)
+        return dedupe_candidates(candidates), complete
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import threading
+import time
+
+QUEUED = "queued"
+CONVERTING = "converting"
+STALE_AFTER = 30 * 86400
+
+class RunJournal:
+    """Durable record of tracks with work in flight, stored in SQLite (WAL mode).
+
+    A track is "queued" once SABnzbd accepted its NZB (with the nzo_id and job
+    name) and "converting" while its FLAC file waits for the transcoder.
+    Entries are removed when the track is archived or given up, so after a
+    crash or stop the next run can resume exactly those tracks.
+    """
+
+    def __init__(self, db_path, logger):
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "track_id TEXT PRIMARY KEY, state TEXT NOT NULL, playlist TEXT, nzo_id TEXT, "
+            "nzb_title TEXT, path TEXT, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls, env, logger):
+        return cls(os.path.join(env["SONG_ARCHIVE_DIR"], "journal.db"), logger)
+
+    def record(self, track_id, state, playlist=None, nzo_id=None, nzb_title=None, path=None):
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO jobs (track_id, state, playlist, nzo_id, nzb_title, path, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (track_id, state, playlist, nzo_id, nzb_title, path, time.time())
+                )
+                self._conn.commit()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error writing run journal: {e}")
+
+    def get(self, track_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE track_id = ?", (track_id,)).fetchone()
+        return dict(row) if row else None
+
+    def remove(self, track_id):
+        try:
+            with self._lock:
+                self._conn.execute("DELETE FROM jobs WHERE track_id = ?", (track_id,))
+                self._conn.commit()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error writing run journal: {e}")
+
+    def pending(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs ORDER BY updated_at").fetchall()
+        return [dict(row) for row in rows]
+
+    def prune(self, max_age=STALE_AFTER):
+        """Drops entries that were not touched for max_age seconds, e.g. of tracks removed from every playlist."""
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM jobs WHERE updated_at < ?", (time.time() - max_age,)).rowcount
+            self._conn.commit()
+        if removed:
+            self.logger.info(f"Dropped {removed} stale entries from the run journal.")
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+import time
+
+class LibraryIndex:
+    """In-memory index of the Artist/Title/"Artist - Title.ext" files in CLEAN_DIR.
+
+    The index is persisted between runs. On load only the artist folders whose
+    mtime changed are rescanned (a new or removed title folder changes it); a
+    full os.scandir walk happens on first use and every full_scan_interval
+    seconds. Files removed inside a title folder do not show up in that mtime,
+    so find() checks every hit on disk. Code that writes into the library
+    updates the index directly.
+    """
+
+    def __init__(self, clean_dir, state_path, logger, full_scan_interval=604800):
+        self.clean_dir = clean_dir
+        self.state_path = state_path
+        self.logger = logger
+        self.full_scan_interval = full_scan_interval
+        self._artists = None
+        self._last_full_scan = 0
+        self._dirty = False
+        self._touched = set()
+        self._lock = threading.RLock()
+
+    def _ensure_loaded(self):
+        if self._artists is not None:
+            return
+        with self._lock:
+            if self._artists is not None:
+                return
+            self._artists = {}
+            if os.path.exists(self.state_path):
+                try:
+                    with open(self.state_path, "r", encoding="utf-8") as f:
+                        state = json.load(f)
+                    self._artists = state.get("artists", {})
+                    self._last_full_scan = state.get("last_full_scan", 0)
+                except Exception as e:
+                    self.logger.error(f"Error loading library index, rebuilding it: {e}")
+                    self._artists = {}
+            self.refresh(full=time.time() - self._last_full_scan >= self.full_scan_interval)
+
+    def refresh(self, full=False):
+        """Rescans artist folders that changed since the last scan, or all of them if full is set."""
+        with self._lock:
+            if self._artists is None:
+                self._artists = {}
+            start = time.time()
+            seen = set()
+            rescanned = 0
+            try:
+                with os.scandir(self.clean_dir) as entries:
+                    for entry in entries:
+                        if entry.name.startswith(".") or not entry.is_dir(follow_symlinks=False):
+                            continue
+                        seen.add(entry.name)
+                        mtime = entry.stat(follow_symlinks=False).st_mtime
+                        known = self._artists.get(entry.name)
+                        if full or not known or known.get("mtime") != mtime:
+                            try:
+                                self._artists[entry.name] = {"mtime": mtime, "titles": self._scan_artist(entry.path)}
+                                rescanned += 1
+                            except OSError as e:
+                                self.logger.error(f"Error scanning {entry.path}: {e}")
+            except OSError as e:
+                self.logger.error(f"Error scanning library {self.clean_dir}: {e}")
+                return
+
+            for artist in set(self._artists) - seen:
+                del self._artists[artist]
+            if full:
+                self._last_full_scan = time.time()
+            self._dirty = True
+            self.logger.info(f"Library index refreshed: {rescanned} of {len(seen)} artist folders scanned in {time.time() - start:.1f}s.")
+
+    def _scan_artist(self, artist_path):
+        artist = os.path.basename(artist_path)
+        titles = {}
+        with os.scandir(artist_path) as title_entries:
+            for title_entry in title_entries:
+                if not title_entry.is_dir(follow_symlinks=False):
+                    continue
+                prefix = f"{artist} - {title_entry.name}."
+                with os.scandir(title_entry.path) as files:
+                    exts = [name[len(prefix):] for name in (f.name for f in files) if name.startswith(prefix)]
+                if exts:
+                    titles[title_entry.name] = exts
+        return titles
+
+    def find(self, artist, title, exts=("ogg", "mp3")):
+        """Returns the first of exts that exists for Artist/Title, or None.
+
+        Each hit is checked on disk: deleting a file inside a title folder does
+        not change the artist folder's mtime, so the index can be stale.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            present = list(self._artists.get(artist, {}).get("titles", {}).get(title, []))
+        for ext in exts:
+            if ext not in present:
+                continue
+            if os.path.exists(os.path.join(self.clean_dir, artist, title, f"{artist} - {title}.{ext}")):
+                return ext
+            self.logger.info(f"Library index entry '{artist} - {title}.{ext}' is no longer on disk, dropping it.")
+            self.discard(artist, title, ext)
+        return None
+
+    def add(self, artist, title, ext):
+        self._ensure_loaded()
+        with self._lock:
+            titles = self._artists.setdefault(artist, {"mtime": None, "titles": {}})["titles"]
+            present = titles.setdefault(title, [])
+            if ext not in present:
+                present.append(ext)
+            self._touched.add(artist)
+            self._dirty = True
+
+    def discard(self, artist, title, ext):
+        self._ensure_loaded()
+        with self._lock:
+            titles = self._artists.get(artist, {}).get("titles", {})
+            if ext in titles.get(title, []):
+                titles[title].remove(ext)
+                if not titles[title]:
+                    del titles[title]
+                self._touched.add(artist)
+                self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if self._artists is None or not self._dirty:
+                return
+            # Artist folders we wrote into got a new mtime; store it so the next load does not rescan them.
+            for artist in self._touched:
+                try:
+                    self._artists[artist]["mtime"] = os.stat(os.path.join(self.clean_dir, artist)).st_mtime
+                except (KeyError, OSError):
+                    pass
+            tmp_path = f"{self.state_path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"last_full_scan": self._last_full_scan, "artists": self._artists}, f)
+                os.replace(tmp_path, self.state_path)
+                self._dirty = False
+                self._touched.clear()
+            except Exception as e:
+                self.logger.error(f"Error saving library index: {e}")
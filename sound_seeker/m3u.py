@@ -0,0 +1,138 @@
+import os
+import threading
+from . import metrics
+
+def track_entry(artist, title, ext):
+    return os.path.join(artist, title, f"{artist} - {title}.{ext}")
+
+def entry_stem(entry):
+    return os.path.splitext(entry)[0]
+
+class M3UPlaylist:
+    def __init__(self, path):
+        self.path = path
+        self.header = None
+        self.entries = {}
+        self.stems = {}
+        self.dirty = False
+        self.pending = 0
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.rstrip("\r\n")
+                    if line.startswith("#EXTM3U") and not self.entries:
+                        self.header = line
+                    elif line and not line.startswith("#"):
+                        self.add_entry(line)
+
+    def add_entry(self, entry):
+        self.entries[entry] = None
+        self.stems.setdefault(entry_stem(entry), entry)
+
+    def remove_entry(self, entry):
+        del self.entries[entry]
+        stem = entry_stem(entry)
+        if self.stems.get(stem) == entry:
+            del self.stems[stem]
+            other = next((e for e in self.entries if entry_stem(e) == stem), None)
+            if other:
+                self.stems[stem] = other
+
+    def set_entries(self, entries):
+        self.entries = {}
+        self.stems = {}
+        for entry in entries:
+            self.add_entry(entry)
+
+    def find(self, artist, title):
+        """Returns the existing entry for artist/title with any extension, or None."""
+        return self.stems.get(entry_stem(track_entry(artist, title, "ogg")))
+
+class M3UManager:
+    """Keeps every .m3u playlist in memory as an ordered set and writes it atomically.
+
+    Each playlist file is read once. Additions are buffered and flushed with a
+    temp file + rename every flush_every additions and at explicit checkpoints.
+    """
+
+    def __init__(self, clean_dir, logger, flush_every=50):
+        self.clean_dir = clean_dir
+        self.logger = logger
+        self.flush_every = flush_every
+        self._playlists = {}
+        self._lock = threading.RLock()
+
+    def _get(self, playlist_name):
+        playlist = self._playlists.get(playlist_name)
+        if playlist is None:
+            playlist = M3UPlaylist(os.path.join(self.clean_dir, f"{playlist_name}.m3u"))
+            self._playlists[playlist_name] = playlist
+        return playlist
+
+    def add(self, playlist_name, artist, title, ext="ogg"):
+        entry = track_entry(artist, title, ext)
+        with self._lock:
+            try:
+                playlist = self._get(playlist_name)
+                if entry in playlist.entries:
+                    self.logger.info(f"'{artist} - {title}' is already in {playlist_name}.m3u. Skipping addition.")
+                    return False
+                playlist.add_entry(entry)
+                playlist.dirty = True
+                playlist.pending += 1
+                self.logger.info(f"'{artist} - {title}' added to {playlist.path}.")
+                if playlist.pending >= self.flush_every:
+                    self.flush(playlist_name)
+                return True
+            except Exception as e:
+                self.logger.error(f"Error while adding to M3U file: {e}")
+                return False
+
+    def remove(self, playlist_name, tracks):
+        """Removes every entry of the given (artist, title) pairs from the playlist."""
+        with self._lock:
+            playlist = self._get(playlist_name)
+            removed = 0
+            for artist, title in tracks:
+                entry = playlist.find(artist, title)
+                while entry:
+                    playlist.remove_entry(entry)
+                    removed += 1
+                    entry = playlist.find(artist, title)
+            if removed:
+                playlist.dirty = True
+                self.logger.info(f"Removed {removed} tracks from {playlist.path}.")
+
+    def find(self, playlist_name, artist, title):
+        with self._lock:
+            return self._get(playlist_name).find(artist, title)
+
+    def rewrite(self, playlist_name, entries):
+        """Replaces the playlist with the given entries in order and flushes it."""
+        with self._lock:
+            playlist = self._get(playlist_name)
+            entries = list(dict.fromkeys(entries))
+            if entries != list(playlist.entries):
+                playlist.set_entries(entries)
+                playlist.dirty = True
+            self.flush(playlist_name)
+
+    def flush(self, playlist_name=None):
+        with self._lock:
+            names = [playlist_name] if playlist_name else list(self._playlists)
+            for name in names:
+                playlist = self._playlists.get(name)
+                if not playlist or not playlist.dirty:
+                    continue
+                tmp_path = f"{playlist.path}.tmp"
+                try:
+                    with metrics.STAGE_SECONDS.time(stage="m3u_write"):
+                        with open(tmp_path, "w", encoding="utf-8") as f:
+                            if playlist.header:
+                                f.write(f"{playlist.header}\n")
+                            f.writelines(f"{entry}\n" for entry in playlist.entries)
+                        os.replace(tmp_path, playlist.path)
+                    playlist.dirty = False
+                    playlist.pending = 0
+                except Exception as e:
+                    self.logger.error(f"Error while writing M3U file {playlist.path}: {e}")
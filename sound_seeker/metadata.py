@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from . import services, metrics
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a fixed TTL."""
+
+    def __init__(self, max_entries=5000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry[0] if entry else None
+
+    def __len__(self):
+        return len(self._entries)
+
+class MetadataService:
+    """Spotify track and playlist metadata backed by a shared, bounded TTL cache.
+
+    Track misses are fetched in batches of 50 with sp.tracks, playlist misses
+    are fetched concurrently.
+    """
+
+    def __init__(self, clients, logger, max_entries=5000, ttl=3600, workers=8):
+        self.clients = clients
+        self.logger = logger
+        self.workers = workers
+        self.cache = TTLCache(max_entries=max_entries, ttl=ttl)
+
+    @classmethod
+    def from_env(cls, clients, env, logger):
+        return cls(clients, logger, max_entries=env['METADATA_CACHE_SIZE'],
+                   ttl=env['METADATA_CACHE_TTL'], workers=env['METADATA_WORKERS'])
+
+    def get_tracks(self, track_ids):
+        """Returns track info for the given ids in order, leaving out unknown tracks."""
+        infos = {}
+        misses = []
+        for track_id in dict.fromkeys(track_ids):
+            info = self.cache.get(("track", track_id))
+            if info is None:
+                misses.append(track_id)
+            else:
+                infos[track_id] = info
+        metrics.CACHE_LOOKUPS.inc(len(infos), cache="metadata", result="hit")
+        metrics.CACHE_LOOKUPS.inc(len(misses), cache="metadata", result="miss")
+
+        if misses:
+            for track_id, info in services.get_tracks_info(self.clients.spotify, misses, self.logger).items():
+                self.cache.set(("track", track_id), info)
+                infos[track_id] = info
+
+        return [infos[track_id] for track_id in track_ids if track_id in infos]
+
+    def get_playlists(self, playlist_ids, refresh=False):
+        """Returns a dict of playlist id to playlist info. Failed lookups map to None.
+
+        With refresh=True cached entries are ignored and every playlist is fetched again.
+        """
+        infos = {}
+        misses = []
+        for playlist_id in dict.fromkeys(playlist_ids):
+            info = None if refresh else self.cache.get(("playlist", playlist_id))
+            if info is None:
+                misses.append(playlist_id)
+            else:
+                infos[playlist_id] = info
+        metrics.CACHE_LOOKUPS.inc(len(infos), cache="metadata", result="hit")
+        metrics.CACHE_LOOKUPS.inc(len(misses), cache="metadata", result="miss")
+
+        if misses:
+            spotify = self.clients.spotify
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(misses))) as pool:
+                results = pool.map(lambda playlist_id: services.get_playlist_info(spotify, playlist_id, self.logger), misses)
+                for playlist_id, info in zip(misses, results):
+                    if info:
+                        self.cache.set(("playlist", playlist_id), info)
+                    infos[playlist_id] = info
+
+        return infos
@@ -0,0 +1,242 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from . import events
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {', '.join(self.labelnames) or 'none'}, got {', '.join(labels) or 'none'}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def series(self):
+        with self._lock:
+            return [(tuple(zip(self.labelnames, key)), value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.render_series())
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render_series(self):
+        return [f"{self.name}{format_labels(labels)} {format_value(value)}" for labels, value in self.series()]
+
+class HistogramValue:
+    __slots__ = ("buckets", "count", "sum", "max")
+
+    def __init__(self, size):
+        self.buckets = [0] * size
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram as understood by Prometheus."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = HistogramValue(len(self.bounds))
+            entry.count += 1
+            entry.sum += value
+            entry.max = max(entry.max, value)
+            for index, bound in enumerate(self.bounds):
+                if value <= bound:
+                    entry.buckets[index] += 1
+                    break
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def series(self):
+        with self._lock:
+            return [(tuple(zip(self.labelnames, key)), (list(entry.buckets), entry.count, entry.sum, entry.max))
+                    for key, entry in sorted(self._values.items())]
+
+    def quantile(self, q, buckets, count, maximum):
+        """Estimates a quantile from bucket counts by linear interpolation, like histogram_quantile(),
+        but never above the largest observed value."""
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        lower = 0.0
+        for bound, bucket in zip(self.bounds, buckets):
+            if bucket and seen + bucket >= rank:
+                upper = min(bound, maximum)
+                return lower + (upper - lower) * (rank - seen) / bucket if upper > lower else upper
+            seen += bucket
+            lower = bound if bound != math.inf else lower
+        return maximum
+
+    def render_series(self):
+        lines = []
+        for labels, (buckets, count, total, _) in self.series():
+            cumulative = 0
+            for bound, bucket in zip(self.bounds, buckets):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{format_labels(labels, [('le', format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter("soundseeker_http_requests_total", "HTTP requests sent, per upstream.", ("upstream",))
+HTTP_ERRORS = REGISTRY.counter("soundseeker_http_errors_total", "HTTP requests that failed or returned an error status after retries.", ("upstream",))
+HTTP_RETRIES = REGISTRY.counter("soundseeker_http_retries_total", "HTTP requests retried.", ("upstream",))
+HTTP_RETRIES_DENIED = REGISTRY.counter("soundseeker_http_retries_denied_total", "Retries refused by the retry budget.", ("upstream",))
+HTTP_RATE_LIMITED = REGISTRY.counter("soundseeker_http_rate_limited_total", "HTTP 429 responses received.", ("upstream",))
+HTTP_THROTTLED = REGISTRY.counter("soundseeker_http_throttled_total", "Requests delayed by the local rate limit.", ("upstream",))
+HTTP_THROTTLE_SECONDS = REGISTRY.counter("soundseeker_http_throttle_seconds_total", "Seconds spent waiting for the local rate limit.", ("upstream",))
+HTTP_STATS = {
+    "requests": HTTP_REQUESTS,
+    "errors": HTTP_ERRORS,
+    "retries": HTTP_RETRIES,
+    "retries_denied": HTTP_RETRIES_DENIED,
+    "rate_limited": HTTP_RATE_LIMITED,
+    "throttled": HTTP_THROTTLED,
+    "throttle_seconds": HTTP_THROTTLE_SECONDS,
+}
+
+INDEXER_SEARCHES = REGISTRY.counter("soundseeker_indexer_searches_total", "Indexer searches by indexer and result (hit, empty, error).", ("indexer", "result"))
+CACHE_LOOKUPS = REGISTRY.counter("soundseeker_cache_lookups_total", "Cache lookups by cache and result (hit, negative_hit, miss).", ("cache", "result"))
+TRACKS = REGISTRY.counter("soundseeker_tracks_total", "Tracks finished, by download method and outcome.", ("method", "outcome"))
+BYTES = REGISTRY.counter("soundseeker_bytes_total", "Bytes of audio moved into the library or transcoded.", ("operation",))
+STAGE_SECONDS = REGISTRY.histogram("soundseeker_stage_duration_seconds", "Time spent per pipeline stage or operation.", ("stage",))
+
+OUTCOMES = {events.TRACK_COMPLETED: "completed", events.TRACK_FAILED: "failed", events.TRACK_SKIPPED: "skipped"}
+
+def record_event(event):
+    """EventBus subscriber counting finished tracks."""
+    outcome = OUTCOMES.get(event.kind)
+    if outcome:
+        TRACKS.inc(method=event.method or "none", outcome=outcome)
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    if seconds < 1:
+        return f"{seconds * 1000:.0f}ms"
+    if seconds < 120:
+        return f"{seconds:.1f}s"
+    return f"{seconds / 60:.1f}min"
+
+def summary_lines():
+    """Human-readable summary of where the time went, for the end of a run."""
+    lines = []
+    tracks = TRACKS.series()
+    if tracks:
+        lines.append("Tracks: " + ", ".join(f"{dict(labels)['outcome']} via {dict(labels)['method']}: {value}" for labels, value in tracks))
+
+    stages = sorted(STAGE_SECONDS.series(), key=lambda entry: entry[1][2], reverse=True)
+    for labels, (buckets, count, total, maximum) in stages:
+        p50 = STAGE_SECONDS.quantile(0.5, buckets, count, maximum)
+        p95 = STAGE_SECONDS.quantile(0.95, buckets, count, maximum)
+        lines.append(f"Stage {dict(labels)['stage']}: {count} times, {format_seconds(total)} total, "
+                     f"p50 {format_seconds(p50)}, p95 {format_seconds(p95)}")
+
+    for labels, value in HTTP_REQUESTS.series():
+        upstream = dict(labels)['upstream']
+        lines.append(f"HTTP {upstream}: {value} requests, {HTTP_ERRORS.get(upstream=upstream)} errors, "
+                     f"{HTTP_RETRIES.get(upstream=upstream)} retries, "
+                     f"{format_seconds(HTTP_THROTTLE_SECONDS.get(upstream=upstream))} throttled")
+
+    indexers = {}
+    for labels, value in INDEXER_SEARCHES.series():
+        labels = dict(labels)
+        indexers.setdefault(labels['indexer'], {})[labels['result']] = value
+    for indexer, results in indexers.items():
+        lines.append(f"Indexer {indexer}: {sum(results.values())} searches, {results.get('hit', 0)} with results, "
+                     f"{results.get('error', 0)} errors")
+
+    caches = {}
+    for labels, value in CACHE_LOOKUPS.series():
+        labels = dict(labels)
+        caches.setdefault(labels['cache'], {})[labels['result']] = value
+    for cache, results in caches.items():
+        lookups = sum(results.values())
+        if not lookups:
+            continue
+        hits = lookups - results.get("miss", 0)
+        lines.append(f"Cache {cache}: {hits}/{lookups} hits ({hits / lookups:.0%})")
+
+    moved = BYTES.series()
+    if moved:
+        lines.append("Bytes: " + ", ".join(f"{dict(labels)['operation']} {value / 1048576:.1f} MB" for labels, value in moved))
+    return lines
@@ -0,0 +1,63 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from . import metrics
+
+STAGES = ("search", "enqueue", "wait", "move", "archive", "spotdl")
+
+class TrackPipeline:
+    """Runs track jobs on a bounded worker pool with a concurrency limit per stage.
+
+    Every job walks through the stages on its own worker thread, so a track
+    waiting for SABnzbd only occupies a "wait" slot while other workers keep
+    searching and enqueueing the following tracks.
+    """
+
+    def __init__(self, workers, stage_limits, logger):
+        self.workers = max(1, workers)
+        self.logger = logger
+        self._stage_slots = {
+            stage: threading.BoundedSemaphore(max(1, stage_limits.get(stage, 1)))
+            for stage in STAGES
+        }
+
+    @classmethod
+    def from_env(cls, env, logger):
+        stage_limits = {stage: env[f"PIPELINE_{stage.upper()}_LIMIT"] for stage in STAGES}
+        return cls(env["PIPELINE_WORKERS"], stage_limits, logger)
+
+    @contextmanager
+    def stage(self, name):
+        with self._stage_slots[name]:
+            with metrics.STAGE_SECONDS.time(stage=name):
+                yield
+
+    def run(self, jobs, handler):
+        """Calls handler(*job) for every job. A handler returning True stops the run.
+
+        A handler raising an exception is logged and only ends its own job.
+        """
+        if self.workers == 1:
+            for job in jobs:
+                try:
+                    if handler(*job) is True:
+                        return
+                except Exception as e:
+                    self.logger.error(f"Unexpected error while processing track: {e}")
+            return
+
+        stopped = threading.Event()
+
+        def run_job(job):
+            if stopped.is_set():
+                return
+            if handler(*job) is True:
+                stopped.set()
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="track") as pool:
+            futures = [pool.submit(run_job, job) for job in jobs]
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    self.logger.error(f"Unexpected error while processing track: {e}")
@@ -0,0 +1,50 @@
+import json
+import os
+import threading
+
+class PlaylistStateStore:
+    """Stores the last seen snapshot_id and resolved track list of every playlist.
+
+    Each playlist is kept in its own JSON file so that a sync only rewrites
+    the playlists that actually changed.
+    """
+
+    def __init__(self, state_dir, logger):
+        self.state_dir = state_dir
+        self.logger = logger
+        self._lock = threading.Lock()
+        os.makedirs(self.state_dir, exist_ok=True)
+
+    def _path(self, playlist_id):
+        return os.path.join(self.state_dir, f"{playlist_id}.json")
+
+    def get(self, playlist_id):
+        path = self._path(playlist_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            self.logger.error(f"Error loading playlist state for {playlist_id}: {e}")
+            return None
+
+    def save(self, playlist_id, snapshot_id, name, tracks):
+        path = self._path(playlist_id)
+        tmp_path = f"{path}.tmp"
+        state = {"snapshot_id": snapshot_id, "name": name, "tracks": tracks}
+        with self._lock:
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                self.logger.error(f"Error saving playlist state for {playlist_id}: {e}")
+
+def diff_tracks(old_tracks, new_tracks):
+    """Returns (added, removed) track items between two resolved track lists."""
+    old_ids = {item['track']['id'] for item in old_tracks}
+    new_ids = {item['track']['id'] for item in new_tracks}
+    added = [item for item in new_tracks if item['track']['id'] not in old_ids]
+    removed = [item for item in old_tracks if item['track']['id'] not in new_ids]
+    return added, removed
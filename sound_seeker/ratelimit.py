@@ -0,0 +1,101 @@
+import math
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+class TokenBucket:
+    """Token-bucket limiter shared by every thread calling one upstream.
+
+    acquire() blocks until a token is available. backoff() blocks all callers
+    until a server-provided deadline (e.g. Retry-After) has passed. A rate of
+    0 disables the limit but still honours backoff().
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, math.ceil(rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Takes a token and returns how long the caller has to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._blocked_until - now)
+            if self.rate <= 0:
+                return wait
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens < 0:
+                wait = max(wait, -self._tokens / self.rate)
+            return wait
+
+    def acquire(self, cancel_scope=None):
+        """Blocks until the request may be sent. Returns the seconds waited.
+
+        Raises InterruptedError if cancel_scope is cancelled while waiting.
+        """
+        wait = self._reserve()
+        if wait > 0:
+            sleep(wait, cancel_scope)
+        return wait
+
+    def backoff(self, seconds):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+def sleep(seconds, cancel_scope=None):
+    """Sleeps for seconds, or raises InterruptedError as soon as cancel_scope is cancelled."""
+    if cancel_scope is None:
+        time.sleep(seconds)
+    elif cancel_scope.sleep(seconds):
+        raise InterruptedError(f"Wait cancelled: {cancel_scope.label}")
+
+class RetryBudget:
+    """Limits retries to a fraction of the requests sent.
+
+    Every request deposits `ratio` retry tokens (up to `max_tokens`) and
+    every retry withdraws one, so a failing upstream cannot multiply the load.
+    """
+
+    def __init__(self, ratio=0.2, min_tokens=10, max_tokens=100):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = min_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+def parse_retry_after(value):
+    """Returns the Retry-After header value in seconds, or None if it is missing or invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def backoff_delay(attempt, factor, cap=60):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, factor * 2 ** attempt))
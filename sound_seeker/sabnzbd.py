@@ -0,0 +1,168 @@
+import threading
+from . import services
+
+FAILED_STATUSES = ("Failed",)
+
+class SabnzbdJob:
+    def __init__(self, nzo_id, nzb_title, on_progress=None):
+        self.nzo_id = nzo_id
+        self.nzb_title = nzb_title
+        self.status = "Queued"
+        self.percentage = 0
+        self.storage = None
+        self.fail_message = ""
+        self.done = threading.Event()
+        self.on_progress = on_progress
+
+    @property
+    def completed(self):
+        return self.done.is_set() and self.status == "Completed"
+
+class SabnzbdTracker:
+    """Tracks all outstanding SABnzbd jobs with a single poller thread.
+
+    Each poll asks SABnzbd for the queue and the (incremental) history of the
+    outstanding nzo_ids only, and wakes the waiting track as soon as its job
+    reaches a final state.
+    """
+
+    def __init__(self, session, sab_url, api_key, logger, poll_interval=2, missing_polls=5):
+        self.session = session
+        self.sab_url = sab_url
+        self.api_key = api_key
+        self.logger = logger
+        self.poll_interval = poll_interval
+        self.missing_polls = missing_polls
+        self._jobs = {}
+        self._missing = {}
+        self._in_history = set()
+        self._last_history_update = None
+        # Bumped by track(), so a poll that started before a job was added does not store its incremental token.
+        self._generation = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+
+    def track(self, nzo_id, nzb_title, on_progress=None):
+        """Starts tracking a job. on_progress(percentage) is called whenever its download percentage changes."""
+        job = SabnzbdJob(nzo_id, nzb_title, on_progress)
+        with self._cond:
+            self._jobs[nzo_id] = job
+            self._missing[nzo_id] = 0
+            # The incremental history token only covers changes after earlier polls; a job that finished
+            # before it was tracked (e.g. resumed from the run journal) needs one full history fetch.
+            self._last_history_update = None
+            self._generation += 1
+            if self._thread is None:
+                self._closed = False
+                self._thread = threading.Thread(target=self._run, name="sabnzbd-tracker", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        return job
+
+    def forget(self, job):
+        with self._cond:
+            self._jobs.pop(job.nzo_id, None)
+            self._missing.pop(job.nzo_id, None)
+            self._in_history.discard(job.nzo_id)
+
+    def wait(self, job, timeout, cancel_scope=None):
+        """Blocks until the job finished, timed out or cancel_scope was cancelled.
+
+        Cancelling the scope wakes the waiter right away; the job then reports
+        completed only if SABnzbd had already finished it.
+        """
+        cancel = cancel_scope.on_cancel(job.done.set) if cancel_scope else None
+        try:
+            if not job.done.wait(timeout):
+                self.logger.warning(f"Timeout: SABnzbd job '{job.nzb_title}' did not complete within {timeout} seconds.")
+        finally:
+            if cancel:
+                cancel_scope.remove_callback(cancel)
+            self.forget(job)
+        return job.completed
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=self.poll_interval + 1)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._jobs and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                self._cond.wait(self.poll_interval)
+                if self._closed:
+                    return
+                nzo_ids = list(self._jobs)
+            if nzo_ids:
+                self.poll(nzo_ids)
+
+    def poll(self, nzo_ids):
+        with self._cond:
+            last_history_update = self._last_history_update
+            generation = self._generation
+        queue = services.get_sabnzbd_queue(self.session, self.sab_url, self.api_key, self.logger, nzo_ids=nzo_ids)
+        history = services.get_sabnzbd_history(self.session, self.sab_url, self.api_key, self.logger, nzo_ids=nzo_ids,
+                                               last_history_update=last_history_update)
+        if queue is None or history is None:
+            return
+
+        seen = set()
+        for slot in queue.get("slots", []):
+            job = self._jobs.get(slot.get("nzo_id"))
+            if job:
+                seen.add(job.nzo_id)
+                job.status = slot.get("status", job.status)
+                try:
+                    percentage = int(slot.get("percentage", 0))
+                except (TypeError, ValueError):
+                    continue
+                if percentage != job.percentage:
+                    job.percentage = percentage
+                    if job.on_progress:
+                        job.on_progress(percentage)
+
+        with self._cond:
+            if history is False:
+                # Unchanged history: jobs it listed last time (e.g. still post-processing) are still there.
+                seen.update(self._in_history.intersection(nzo_ids))
+                history = {}
+            elif generation == self._generation:
+                self._last_history_update = history.get("last_history_update", last_history_update)
+
+            for slot in history.get("slots", []):
+                job = self._jobs.get(slot.get("nzo_id"))
+                if not job:
+                    continue
+                seen.add(job.nzo_id)
+                self._in_history.add(job.nzo_id)
+                job.status = slot.get("status", job.status)
+                if job.status == "Completed":
+                    job.storage = slot.get("storage")
+                    self.logger.info(f"SABnzbd-Job '{job.nzb_title}' completed.")
+                    job.done.set()
+                elif job.status in FAILED_STATUSES:
+                    job.fail_message = slot.get("fail_message", "")
+                    self.logger.warning(f"SABnzbd-Job '{job.nzb_title}' failed: {job.fail_message}")
+                    job.done.set()
+
+            for nzo_id in nzo_ids:
+                job = self._jobs.get(nzo_id)
+                if not job:
+                    continue
+                if nzo_id in seen:
+                    self._missing[nzo_id] = 0
+                    continue
+                self._missing[nzo_id] = self._missing.get(nzo_id, 0) + 1
+                if self._missing[nzo_id] >= self.missing_polls:
+                    job.status = "Failed"
+                    job.fail_message = "Job is no longer known to SABnzbd"
+                    self.logger.warning(f"SABnzbd-Job '{job.nzb_title}' disappeared from queue and history.")
+                    job.done.set()
@@ -0,0 +1,93 @@
+import json
+import sqlite3
+import threading
+import time
+from . import metrics
+
+class SearchCache:
+    """Persistent SQLite cache for indexer search results.
+
+    Positive and negative (no hit) results expire after separate TTLs, and the
+    least recently used entries are evicted once max_entries is exceeded.
+    """
+
+    def __init__(self, db_path, logger, positive_ttl=604800, negative_ttl=259200, max_entries=50000):
+        self.logger = logger
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_cache ("
+            "query TEXT PRIMARY KEY, result TEXT, negative INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS search_cache_accessed ON search_cache (accessed_at)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+
+    @staticmethod
+    def normalize_query(query):
+        return " ".join(query.lower().split())
+
+    def get(self, query):
+        """Returns (found, result). A negative entry is returned as (True, None).
+
+        A database error is logged and reported as a miss, so the search goes to the indexers.
+        """
+        key = self.normalize_query(query)
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT result, negative, created_at FROM search_cache WHERE query = ?", (key,)
+                ).fetchone()
+                if row:
+                    result, negative, created_at = row
+                    ttl = self.negative_ttl if negative else self.positive_ttl
+                    if now - created_at < ttl:
+                        self._conn.execute("UPDATE search_cache SET accessed_at = ? WHERE query = ?", (now, key))
+                        self._conn.commit()
+                        if negative:
+                            metrics.CACHE_LOOKUPS.inc(cache="search", result="negative_hit")
+                            return True, None
+                        metrics.CACHE_LOOKUPS.inc(cache="search", result="hit")
+                        return True, json.loads(result)
+                    self._conn.execute("DELETE FROM search_cache WHERE query = ?", (key,))
+                    self._conn.commit()
+                    self._size -= 1
+            except sqlite3.Error as e:
+                self.logger.error(f"Error reading search cache entry for '{query}': {e}")
+            metrics.CACHE_LOOKUPS.inc(cache="search", result="miss")
+            return False, None
+
+    def put(self, query, result, negative=False):
+        key = self.normalize_query(query)
+        now = time.time()
+        payload = None if negative else json.dumps(result)
+        with self._lock:
+            try:
+                exists = self._conn.execute("SELECT 1 FROM search_cache WHERE query = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO search_cache (query, result, negative, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)", (key, payload, int(negative), now, now)
+                )
+                if not exists:
+                    self._size += 1
+                if self._size > self.max_entries:
+                    self._evict(self._size - self.max_entries)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self.logger.error(f"Error writing search cache entry for '{query}': {e}")
+
+    def _evict(self, count):
+        self._conn.execute(
+            "DELETE FROM search_cache WHERE query IN "
+            "(SELECT query FROM search_cache ORDER BY accessed_at LIMIT ?)", (count,)
+        )
+        self._size -= count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
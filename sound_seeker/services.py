@@ -1,59 +1,133 @@
 import os
-import requests
-import xmltodict
-import urllib.parse
+import itertools
+from xml.etree import ElementTree
 import subprocess
-import time
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
+from . import metrics
 
-def get_music_by_search(query, api_key, logger):
+NEWZNAB_ATTR_TAG = "{http://www.newznab.com/DTD/2010/feeds/attributes/}attr"
+
+def newznab_item_to_candidate(item):
+    """Reduces a parsed newznab RSS <item> element to the fields used for ranking and download."""
+    enclosure = item.find("enclosure")
+    url = enclosure.get("url") if enclosure is not None else None
+    if not url:
+        return None
+    attrs = {attr.get("name"): attr.get("value") for attr in item.iter(NEWZNAB_ATTR_TAG)}
+    size = attrs.get("size") or enclosure.get("length")
     try:
-        query_encoded = urllib.parse.quote(query)
-        url = f"https://scenenzbs.com/api?t=search&q={query_encoded}&apikey={api_key}"
-        response = requests.get(url)
-        response.raise_for_status()
-        return xmltodict.parse(response.content)
+        size = int(size)
+    except (TypeError, ValueError):
+        size = None
+    return {
+        'title': item.findtext("title") or '',
+        'url': url,
+        'size': size,
+        'pubdate': item.findtext("pubDate"),
+        'attrs': attrs,
+    }
+
+def iter_newznab_items(stream):
+    """Yields candidates from a newznab RSS stream, parsing one <item> at a time."""
+    for _, element in ElementTree.iterparse(stream, events=("end",)):
+        if element.tag == "item":
+            candidate = newznab_item_to_candidate(element)
+            element.clear()
+            if candidate:
+                yield candidate
+
+def search_newznab(session, api_url, api_key, query, logger, timeout=None, indexer_name="indexer", max_results=None):
+    """Searches a newznab-compatible indexer. Returns a list of candidates or None on error.
+
+    The response is parsed while it streams in and reading stops after
+    max_results candidates.
+    """
+    try:
+        params = {"t": "search", "q": query, "apikey": api_key}
+        if max_results:
+            params["limit"] = max_results
+        with session.get(api_url, params=params, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            candidates = list(itertools.islice(iter_newznab_items(response.raw), max_results))
+        metrics.INDEXER_SEARCHES.inc(indexer=indexer_name, result="hit" if candidates else "empty")
+        return candidates
     except Exception as e:
-        logger.error(f"Error fetching music by search from scenenzbs: {e}")
+        logger.error(f"Error searching {indexer_name}: {e}")
+        metrics.INDEXER_SEARCHES.inc(indexer=indexer_name, result="error")
         return None
 
-def send_to_sabnzbd(nzb_url, nzb_title, sab_url, api_key, cat, logger):
+def send_to_sabnzbd(session, nzb_url, nzb_title, sab_url, api_key, cat, logger):
     try:
         params = {"mode": "addurl", "name": nzb_url, "apikey": api_key, "cat": cat, "nzbname": nzb_title}
         url = f"{sab_url}/api"
-        r = requests.get(url, params=params)
+        r = session.get(url, params=params)
         r.raise_for_status()
         return r.json()
     except Exception as e:
         logger.error(f"Error sending NZB to SABnzbd: {e}")
         return None
 
-def wait_for_sabnzbd_job(nzb_title, sab_url, api_key, logger, timeout=1000, poll_interval=10):
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        try:
-            resp = requests.get(f"{sab_url}/api", params={"mode": "history", "output": "json", "apikey": api_key})
-            data = resp.json()
-            for job in data.get("history", {}).get("slots", []):
-                if job.get("name") == nzb_title and job.get("status") == "Completed":
-                    logger.info(f"SABnzbd-Job '{nzb_title}' completed.")
-                    return True
-            logger.info(f"Waiting for SABnzbd job '{nzb_title}' to complete...")
-            time.sleep(poll_interval)
-        except Exception as e:
-            logger.error(f"Error while checking SABnzbd job status: {e}")
-            time.sleep(poll_interval)
-    logger.error(f"Timeout: SABnzbd job '{nzb_title}' did not complete within {timeout} seconds.")
-    return False
+def get_sabnzbd_queue(session, sab_url, api_key, logger, nzo_ids=None):
+    try:
+        params = {"mode": "queue", "output": "json", "apikey": api_key}
+        if nzo_ids:
+            params["nzo_ids"] = ",".join(nzo_ids)
+        r = session.get(f"{sab_url}/api", params=params)
+        r.raise_for_status()
+        return r.json().get("queue", {})
+    except Exception as e:
+        logger.error(f"Error fetching SABnzbd queue: {e}")
+        return None
 
-def find_playlist_tracks(playlist_id, client_id, client_secret, logger):
+def get_sabnzbd_history(session, sab_url, api_key, logger, nzo_ids=None, last_history_update=None):
+    """Returns the history dict, or False if nothing changed since last_history_update."""
     try:
-        sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=client_id, client_secret=client_secret))
-        
-        playlist_info = sp.playlist(playlist_id, fields="name,tracks.total")
-        playlist_name = playlist_info['name']
-        total_tracks = playlist_info['tracks']['total']
+        params = {"mode": "history", "output": "json", "apikey": api_key}
+        if nzo_ids:
+            params["nzo_ids"] = ",".join(nzo_ids)
+        if last_history_update is not None:
+            params["last_history_update"] = last_history_update
+        r = session.get(f"{sab_url}/api", params=params)
+        r.raise_for_status()
+        return r.json().get("history") or False
+    except Exception as e:
+        logger.error(f"Error fetching SABnzbd history: {e}")
+        return None
+
+def get_playlist_snapshot(sp, playlist_id, logger):
+    try:
+        playlist = sp.playlist(playlist_id, fields="name,snapshot_id,tracks.total")
+        return {
+            'id': playlist_id,
+            'name': playlist['name'],
+            'snapshot_id': playlist['snapshot_id'],
+            'tracks_total': playlist['tracks']['total']
+        }
+    except Exception as e:
+        logger.error(f"Error fetching playlist snapshot: {e}")
+        return None
+
+def slim_track_item(item):
+    """Keeps only the track fields SoundSeeker uses, so resolved playlists stay small on disk."""
+    track = item.get('track') if item else None
+    if not track or not track.get('id'):
+        return None
+    return {'track': {
+        'id': track['id'],
+        'name': track['name'],
+        'artists': [{'name': artist['name']} for artist in track['artists']],
+        'duration_ms': track.get('duration_ms')
+    }}
+
+def find_playlist_tracks(sp, playlist_id, logger, snapshot=None):
+    """Returns (playlist name, tracks). Tracks is None if the playlist could not be fetched."""
+    try:
+        if snapshot is None:
+            snapshot = get_playlist_snapshot(sp, playlist_id, logger)
+            if snapshot is None:
+                return None, None
+        playlist_name = snapshot['name']
+        total_tracks = snapshot['tracks_total']
 
         if total_tracks == 0:
             logger.warning(f"Playlist '{playlist_name}' is empty.")
@@ -61,71 +135,83 @@ def find_playlist_tracks(playlist_id, client_id, client_secret, logger):
 
         logger.info(f"Fetching {total_tracks} tracks from playlist '{playlist_name}'...")
 
-        all_tracks = []
-        results = sp.playlist_tracks(playlist_id)
-        all_tracks.extend(results['items'])
+        all_items = []
+        results = sp.playlist_tracks(playlist_id, fields="items(track(id,name,duration_ms,artists(name))),next")
+        all_items.extend(results['items'])
 
         while results['next']:
             results = sp.next(results)
-            all_tracks.extend(results['items'])
-            logger.info(f"Fetched {len(all_tracks)}/{total_tracks} tracks...")
+            all_items.extend(results['items'])
+            logger.info(f"Fetched {len(all_items)}/{total_tracks} tracks...")
+
+        all_tracks = [item for item in map(slim_track_item, all_items) if item]
+        if len(all_tracks) < len(all_items):
+            logger.warning(f"Ignoring {len(all_items) - len(all_tracks)} unavailable or local tracks in '{playlist_name}'.")
 
         logger.info(f"Successfully fetched all {len(all_tracks)} tracks from '{playlist_name}'.")
         return playlist_name, all_tracks
         
     except Exception as e:
         logger.error(f"Error fetching playlist tracks: {e}")
-        return None, []
+        return None, None
 
-def download_with_spotdl(track_id, artist, title, clean_dir, logger, audio_format="ogg"):
+def download_with_spotdl(track_ids, output_dir, logger, audio_format="ogg", threads=4, cancel_scope=None, spotdl_bin="spotdl"):
+    """Downloads a batch of tracks with a single spotdl process.
+
+    Every track is written to output_dir as "<track id>.<audio_format>". The
+    process is terminated if cancel_scope is cancelled while it runs.
+    Returns (dict of track id to downloaded file, list of spotdl error lines).
+    """
+    spotify_urls = [f"https://open.spotify.com/track/{track_id}" for track_id in track_ids]
+    cmd = [
+        spotdl_bin, "download", *spotify_urls,
+        "--output", os.path.join(output_dir, "{track-id}.{output-ext}"),
+        "--format", audio_format,
+        "--threads", str(threads),
+        "--audio", "youtube-music, youtube",
+        "--overwrite", "force",
+        "--cookie-file", os.path.join(os.getenv("COOKIES_PATH"), "yt_cookies.txt"),
+        "--client-id", os.getenv("SPOTIFY_CLIENT_ID"),
+        "--client-secret", os.getenv("SPOTIFY_CLIENT_SECRET"),
+    ]
+    errors = []
     try:
-        artist_dir = os.path.join(clean_dir, artist)
-        song_dir = os.path.join(artist_dir, title)
-        os.makedirs(song_dir, exist_ok=True)
-        spotify_url = f"https://open.spotify.com/track/{track_id}"
-        cmd = [
-            "spotdl", "download", spotify_url,
-            "--output", song_dir,
-            "--format", audio_format,
-            "--audio", "youtube-music, youtube",
-            "--overwrite", "force",
-            "--cookie-file", os.path.join(os.getenv("COOKIES_PATH"), "yt_cookies.txt"),
-            "--client-id", os.getenv("SPOTIFY_CLIENT_ID"),
-            "--client-secret", os.getenv("SPOTIFY_CLIENT_SECRET"),
-        ]
-        logger.info(f"Downloading with SpotDL: {artist} - {title}.{audio_format}")
         process = subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
             text=True,
             bufsize=1
         )
-        
-        for line in process.stdout:
-            line = line.strip()
-            if line:
-                logger.info(f"SpotDL: {line}")
-        
-        stderr_output = process.stderr.read()
-        return_code = process.wait()
-        
-        if return_code != 0:
-            logger.error(f"SpotDL-Error: {stderr_output}")
-            raise subprocess.CalledProcessError(return_code, cmd, stderr_output)
-        
-        logger.info(f"Successfully downloaded '{artist} - {title}.{audio_format}'")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"SpotDL-Error: {e.stderr}")
-        raise
+        cancel = cancel_scope.on_cancel(process.terminate) if cancel_scope else None
+        try:
+            for line in process.stdout:
+                line = line.strip()
+                if line:
+                    logger.info(f"SpotDL: {line}")
+                    if "error" in line.lower() or "no results found" in line.lower():
+                        errors.append(line)
+            return_code = process.wait()
+        finally:
+            if cancel:
+                cancel_scope.remove_callback(cancel)
+
+        if cancel_scope and cancel_scope.cancelled:
+            logger.info("SpotDL download was cancelled.")
+        elif return_code != 0:
+            logger.error(f"SpotDL-Error: spotdl exited with code {return_code}")
     except Exception as e:
         logger.error(f"Common error during SpotDL download: {e}")
-        raise
+
+    downloaded = {}
+    for track_id in track_ids:
+        file_path = os.path.join(output_dir, f"{track_id}.{audio_format}")
+        if os.path.exists(file_path):
+            downloaded[track_id] = file_path
+    return downloaded, errors
     
-def get_playlist_info(playlist_id, client_id, client_secret, logger):
+def get_playlist_info(sp, playlist_id, logger):
     try:
-        sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=client_id, client_secret=client_secret))
-        
         playlist = sp.playlist(playlist_id, fields="name,images,owner,tracks.total")
         
         image_url = playlist['images'][0]['url'] if playlist.get('images') else ''
@@ -142,22 +228,27 @@ def get_playlist_info(playlist_id, client_id, client_secret, logger):
         logger.error(f"Error getting playlist info: {e}")
         return None
     
-def get_track_info(track_id, client_id, client_secret, logger):
-    try:
-        sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=client_id, client_secret=client_secret))
-        
-        track = sp.track(track_id)
-        
-        artists = ", ".join([artist['name'] for artist in track['artists']])
-        image_url = track['album']['images'][0]['url'] if track['album'].get('images') else ''
-        
-        return {
-            'id': track_id,
-            'name': track['name'],
-            'artists': artists,
-            'image': image_url,
-            'album': track['album']['name']
-        }
-    except Exception as e:
-        logger.error(f"Error getting track info: {e}")
-        return None
\ No newline at end of file
+def track_to_info(track):
+    artists = ", ".join([artist['name'] for artist in track['artists']])
+    image_url = track['album']['images'][0]['url'] if track['album'].get('images') else ''
+    
+    return {
+        'id': track['id'],
+        'name': track['name'],
+        'artists': artists,
+        'image': image_url,
+        'album': track['album']['name']
+    }
+
+def get_tracks_info(sp, track_ids, logger, batch_size=50):
+    """Fetches track info for many tracks with one request per batch of 50 ids."""
+    infos = {}
+    for start in range(0, len(track_ids), batch_size):
+        batch = track_ids[start:start + batch_size]
+        try:
+            for track in sp.tracks(batch).get('tracks', []):
+                if track:
+                    infos[track['id']] = track_to_info(track)
+        except Exception as e:
+            logger.error(f"Error getting track info for {len(batch)} tracks: {e}")
+    return infos
@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+class Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def set(self, **attrs):
+        """Adds attributes that are only known once the span is running, e.g. the file extension found."""
+        self.args.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc}"
+        self.tracer.record(self.name, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+class NullSpan:
+    """Shared no-op span returned while tracing is disabled."""
+
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class NullTracer:
+    enabled = False
+
+    def span(self, name, **attrs):
+        return NULL_SPAN
+
+    def close(self):
+        pass
+
+class Tracer:
+    """Records nested spans per thread and writes them as a Chrome trace (JSON) file.
+
+    Spans become complete ("X") events on the thread that ran them, so the
+    trace opens as a timeline in Perfetto or chrome://tracing with one row
+    per pipeline worker, transcoder and poller thread. Events are kept in
+    memory and written by close().
+    """
+
+    enabled = True
+
+    def __init__(self, path, logger):
+        self.path = path
+        self.logger = logger
+        self.pid = os.getpid()
+        self._origin = time.perf_counter_ns()
+        self._events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def span(self, name, **attrs):
+        return Span(self, name, attrs)
+
+    def record(self, name, start, end, args):
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (start - self._origin) / 1000,
+            "dur": (end - start) / 1000,
+            "pid": self.pid,
+            "tid": thread.ident,
+            "args": args,
+        }
+        with self._lock:
+            self._events.append(event)
+            self._threads.setdefault(thread.ident, thread.name)
+
+    def close(self):
+        with self._lock:
+            events, self._events = self._events, []
+            threads = dict(self._threads)
+        metadata = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                    for tid, name in threads.items()]
+        metadata.append({"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": "SoundSeeker"}})
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f, default=str)
+            self.logger.info(f"Wrote {len(events)} trace events to {self.path}.")
+        except OSError as e:
+            self.logger.error(f"Error writing trace file {self.path}: {e}")
+
+def from_env(env, logger):
+    """Returns a Tracer writing to TRACE_PATH, or a NullTracer if it is not set.
+
+    If TRACE_PATH is a directory, every run writes its own timestamped file into it.
+    """
+    path = env['TRACE_PATH']
+    if not path:
+        return NullTracer()
+    if os.path.isdir(path):
+        path = os.path.join(path, f"trace-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    logger.info(f"Tracing enabled, the trace will be written to {path}.")
+    return Tracer(path, logger)
@@ -0,0 +1,99 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from . import file_handler
+from .tracing import NullTracer
+
+PROFILES = {
+    "vorbis-320": {"codec": "libvorbis", "bitrate": "320k", "ext": "ogg"},
+    "vorbis-192": {"codec": "libvorbis", "bitrate": "192k", "ext": "ogg"},
+    "opus-192": {"codec": "libopus", "bitrate": "192k", "ext": "ogg"},
+    "opus-128": {"codec": "libopus", "bitrate": "128k", "ext": "ogg"},
+    "mp3-320": {"codec": "libmp3lame", "bitrate": "320k", "ext": "mp3"},
+}
+
+class Transcoder:
+    """Runs ffmpeg transcodes in the background, one ffmpeg process per worker.
+
+    Jobs are submitted asynchronously and return a Future resolving to the
+    output file. The optional on_done(dst_file, error) callback runs on the
+    worker before the Future completes, so drain() also waits for it. Outputs
+    newer than their source are reused without running ffmpeg again. Jobs
+    submitted with a cancel_scope are skipped or terminated once it is cancelled.
+    """
+
+    def __init__(self, profile, logger, workers=None, ffmpeg_bin="ffmpeg", tracer=None):
+        self.profile = profile
+        self.logger = logger
+        self.ffmpeg_bin = ffmpeg_bin
+        self.tracer = tracer or NullTracer()
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, env, logger, tracer=None):
+        name = env['TRANSCODE_PROFILE']
+        if name not in PROFILES:
+            raise ValueError(f"Unknown TRANSCODE_PROFILE '{name}'. Available profiles: {', '.join(PROFILES)}")
+        profile = dict(PROFILES[name])
+        if env['TRANSCODE_BITRATE']:
+            profile["bitrate"] = env['TRANSCODE_BITRATE']
+        return cls(profile, logger, workers=env['TRANSCODE_WORKERS'], ffmpeg_bin=env['FFMPEG_BIN'], tracer=tracer)
+
+    @property
+    def ext(self):
+        return self.profile["ext"]
+
+    def submit(self, src_file, dst_file, on_done=None, cancel_scope=None):
+        if file_handler.is_up_to_date(src_file, dst_file):
+            self.logger.info(f"Skipping conversion, {dst_file} is up to date.")
+            if on_done:
+                on_done(dst_file, None)
+            future = Future()
+            future.set_result(dst_file)
+            return future
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="transcode")
+            future = self._executor.submit(self._transcode, src_file, dst_file, on_done, cancel_scope)
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _transcode(self, src_file, dst_file, on_done, cancel_scope):
+        try:
+            with self.tracer.span("ffmpeg", src=src_file, dst=dst_file, codec=self.profile["codec"]) as span:
+                if self.tracer.enabled:
+                    span.set(bytes_in=os.path.getsize(src_file))
+                file_handler.transcode_audio(src_file, dst_file, self.logger, self.profile["codec"], self.profile["bitrate"],
+                                             cancel_scope=cancel_scope, ffmpeg_bin=self.ffmpeg_bin)
+                if self.tracer.enabled:
+                    span.set(bytes_out=os.path.getsize(dst_file))
+        except Exception as e:
+            if on_done:
+                on_done(None, e)
+            raise
+        if on_done:
+            on_done(dst_file, None)
+        return dst_file
+
+    def _discard(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def drain(self):
+        """Blocks until every submitted job has finished."""
+        with self._lock:
+            pending = list(self._pending)
+        if pending:
+            self.logger.info(f"Waiting for {len(pending)} pending conversions...")
+            wait(pending)
+
+    def shutdown(self, cancel_pending=False):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=cancel_pending)
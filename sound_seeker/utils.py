@@ -3,6 +3,53 @@ import os
 
 cached_env = None
 
+OPTIONAL_ENV_DEFAULTS = {
+    "PIPELINE_WORKERS": 1,
+    "PIPELINE_SEARCH_LIMIT": 2,
+    "PIPELINE_ENQUEUE_LIMIT": 2,
+    "PIPELINE_WAIT_LIMIT": 8,
+    "PIPELINE_MOVE_LIMIT": 2,
+    "PIPELINE_ARCHIVE_LIMIT": 1,
+    "PIPELINE_SPOTDL_LIMIT": 1,
+    "SABNZBD_POLL_INTERVAL": 2.0,
+    "SABNZBD_JOB_TIMEOUT": 3600,
+    "SEARCH_CACHE_TTL": 604800,
+    "SEARCH_CACHE_NEGATIVE_TTL": 259200,
+    "SEARCH_CACHE_MAX_ENTRIES": 50000,
+    "SCENENZBS_URL": "https://scenenzbs.com/api",
+    "EXTRA_INDEXERS": "",
+    "INDEXER_TIMEOUT": 15,
+    "INDEXER_MAX_RESULTS": 25,
+    "INDEXER_MIN_SIMILARITY": 60,
+    "HTTP_POOL_SIZE": 10,
+    "HTTP_RETRIES": 3,
+    "HTTP_BACKOFF_FACTOR": 0.5,
+    "HTTP_TIMEOUT": 30,
+    "HTTP_RETRY_BUDGET": 0.2,
+    "HTTP_MAX_RETRY_AFTER": 120,
+    "RATE_LIMIT_SPOTIFY": 5.0,
+    "RATE_LIMIT_INDEXER": 1.0,
+    "RATE_LIMIT_SABNZBD": 0.0,
+    "SPOTIFY_API_URL": "https://api.spotify.com/v1/",
+    "SPOTIFY_AUTH_URL": "https://accounts.spotify.com/api/token",
+    "METADATA_CACHE_SIZE": 5000,
+    "METADATA_CACHE_TTL": 3600,
+    "METADATA_WORKERS": 8,
+    "PLAYLIST_CATALOG_TTL": 3600,
+    "ARCHIVE_COMPACT_INTERVAL": 604800,
+    "M3U_FLUSH_EVERY": 50,
+    "LIBRARY_FULL_SCAN_INTERVAL": 604800,
+    "FOLDER_CLEANUP_RATE": 50.0,
+    "TRANSCODE_PROFILE": "vorbis-320",
+    "TRANSCODE_BITRATE": "",
+    "TRANSCODE_WORKERS": 0,
+    "SPOTDL_BATCH_SIZE": 25,
+    "SPOTDL_THREADS": 4,
+    "TRACE_PATH": "",
+    "SPOTDL_BIN": "spotdl",
+    "FFMPEG_BIN": "ffmpeg",
+}
+
 def get_cached_env(logger, force_refresh=False):
     global cached_env
     if cached_env is None or force_refresh:
@@ -22,6 +69,9 @@ def check_and_load_env(logger, silent=False):
     if missing_vars:
         raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
 
+    for key, default in OPTIONAL_ENV_DEFAULTS.items():
+        env[key] = parse_env_value(key, os.getenv(key), default)
+
     playlists_path = os.path.join(env["SPOTIFY_PLAYLISTS_PATH"], 'playlists.txt')
     if not os.path.exists(playlists_path):
         raise FileNotFoundError(f"Configuration file not found: playlists.txt was expected in '{env['SPOTIFY_PLAYLISTS_PATH']}'")
@@ -39,6 +89,18 @@ def check_and_load_env(logger, silent=False):
         logger.info("Environment variables and configuration files validated successfully.")
     return env
 
+def parse_env_value(key, value, default):
+    """Converts an optional environment variable to the type of its default value."""
+    if value is None or value.strip() == "":
+        return default
+    value = value.strip()
+    try:
+        if isinstance(default, bool):
+            return value.lower() in ("1", "true", "yes", "on")
+        return type(default)(value)
+    except ValueError:
+        raise ValueError(f"Invalid value for {key}: '{value}' (expected {type(default).__name__})")
+
 def setup_logger(level=logging.INFO):
     logger = logging.getLogger("SoundSeeker")
     if not logger.hasHandlers():
@@ -48,26 +110,3 @@ def setup_logger(level=logging.INFO):
         handler.setFormatter(formatter)
         logger.addHandler(handler)
     return logger
-
-def load_song_archive(archive_path, logger):
-    if not os.path.exists(archive_path):
-        logger.info(f"Song archive not found at {archive_path}. Creating a new one.")
-        os.makedirs(os.path.dirname(archive_path), exist_ok=True)
-        with open(archive_path, "w") as f:
-            pass
-        return set()
-    
-    try:
-        with open(archive_path, "r") as f:
-            return {line.strip() for line in f if line.strip()}
-    except Exception as e:
-        logger.error(f"Error loading song archive: {e}")
-        return set()
-
-def save_to_song_archive(archive_path, track_id, logger):
-    try:
-        with open(archive_path, "a") as f:
-            f.write(f"{track_id}\n")
-        logger.info(f"Added '{track_id}' to song archive.")
-    except Exception as e:
-        logger.error(f"Error saving to song archive: {e}")
@@ -0,0 +1,98 @@
+import logging
+import threading
+import unittest
+
+from sound_seeker.sabnzbd import SabnzbdTracker
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+class FakeSabnzbd:
+    """Answers queue and history calls like SABnzbd, including the incremental last_history_update token."""
+
+    def __init__(self):
+        self.queue = []
+        self.history = []
+        self.version = 1
+        self._lock = threading.Lock()
+
+    def finish(self, nzo_id, status="Completed"):
+        with self._lock:
+            self.history.append({"nzo_id": nzo_id, "status": status, "storage": f"/downloads/{nzo_id}"})
+            self.version += 1
+
+    def get(self, url, params):
+        wanted = set(params.get("nzo_ids", "").split(","))
+        with self._lock:
+            if params["mode"] == "queue":
+                return FakeResponse({"queue": {"slots": [slot for slot in self.queue if slot["nzo_id"] in wanted]}})
+            if params.get("last_history_update") == self.version:
+                return FakeResponse({"history": False})
+            slots = [slot for slot in self.history if slot["nzo_id"] in wanted]
+            return FakeResponse({"history": {"slots": slots, "last_history_update": self.version}})
+
+class SabnzbdTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.sabnzbd = FakeSabnzbd()
+        self.tracker = SabnzbdTracker(self.sabnzbd, "http://sabnzbd", "key", logging.getLogger("test"),
+                                      poll_interval=0.01, missing_polls=3)
+        self.addCleanup(self.tracker.close)
+
+    def test_job_already_in_history_completes(self):
+        self.sabnzbd.finish("first")
+        self.assertTrue(self.tracker.wait(self.tracker.track("first", "First"), timeout=2))
+
+        # Finished before it is tracked, while the tracker's history token is already current.
+        self.sabnzbd.finish("second")
+        self.tracker.poll(["first"])
+        job = self.tracker.track("second", "Second")
+        self.assertTrue(self.tracker.wait(job, timeout=2))
+        self.assertEqual(job.storage, "/downloads/second")
+
+    def test_job_tracked_during_a_poll_gets_a_full_history_fetch(self):
+        self.tracker.poll_interval = 60  # polls are driven by the test
+        self.sabnzbd.finish("first")
+        self.tracker.track("first", "First")
+        self.sabnzbd.finish("second")
+        real_get = self.sabnzbd.get
+
+        def get(url, params):
+            # "second" is tracked while this poll's history request is in flight.
+            if params["mode"] == "history":
+                self.sabnzbd.get = real_get
+                self.tracker.track("second", "Second")
+            return real_get(url, params)
+
+        self.sabnzbd.get = get
+        self.tracker.poll(["first"])
+        self.assertIsNone(self.tracker._last_history_update)
+        self.tracker.poll(["second"])
+        self.assertTrue(self.tracker._jobs["second"].completed)
+
+    def test_job_missing_from_queue_and_unchanged_history_fails(self):
+        self.sabnzbd.finish("other")
+        self.assertTrue(self.tracker.wait(self.tracker.track("other", "Other"), timeout=2))
+
+        job = self.tracker.track("lost", "Lost")
+        self.assertFalse(self.tracker.wait(job, timeout=2))
+        self.assertTrue(job.done.is_set())
+        self.assertEqual(job.fail_message, "Job is no longer known to SABnzbd")
+
+    def test_job_post_processing_in_unchanged_history_is_not_missing(self):
+        self.sabnzbd.history.append({"nzo_id": "slow", "status": "Extracting"})
+        job = self.tracker.track("slow", "Slow")
+        for _ in range(5):
+            self.tracker.poll(["slow"])
+        self.assertFalse(job.done.is_set())
+        self.sabnzbd.finish("slow")
+        self.assertTrue(self.tracker.wait(job, timeout=2))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,8 +5,11 @@ document.addEventListener('DOMContentLoaded', function() {
         paused: false,
         total_tracks: 0,
         processed_tracks: 0,
+        failed_tracks: 0,
+        skipped_tracks: 0,
         current_track: '',
-        current_method: ''
+        current_method: '',
+        current_percent: null
     };
 
     const startBtn = document.getElementById('start-btn');
@@ -35,18 +38,33 @@ document.addEventListener('DOMContentLoaded', function() {
     socket.on('disconnect', () => {
     });
 
-    socket.on('log_message', (data) => {
-        addLogMessage(data.timestamp, data.level, data.message);
+    socket.on('log_backlog', (entries) => {
+        logMessages.innerHTML = '';
+        entries.forEach(data => addLogMessage(data.timestamp, data.level, data.message, false));
+        scrollLogToBottom();
+    });
+
+    socket.on('log_batch', (entries) => {
+        entries.forEach(data => addLogMessage(data.timestamp, data.level, data.message, false));
+        scrollLogToBottom();
     });
 
     socket.on('status_update', (data) => {
         updateDownloadStatus(data);
     });
 
+    socket.on('status_delta', (delta) => {
+        updateDownloadStatus(Object.assign({}, downloadStatus, delta));
+    });
+
     socket.on('update_recent_downloads', (data) => {
         loadDownloadedSongs();
     });
 
+    socket.on('playlists_update', (playlists) => {
+        renderPlaylists(playlists);
+    });
+
     startBtn.addEventListener('click', () => {
         if (downloadStatus.paused) {
             fetch('/api/downloads/start', { method: 'POST' })
@@ -119,7 +137,7 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(data => {
             if (data.success) {
                 playlistInput.value = '';
-                loadPlaylists();
+                renderPlaylists(data.playlists);
                 addLogMessage('System', 'INFO', 'Playlist successfully added');
             } else {
                 addLogMessage('System', 'ERROR', 'Error adding playlist: ' + data.message);
@@ -150,11 +168,18 @@ document.addEventListener('DOMContentLoaded', function() {
                 ? (downloadStatus.processed_tracks / downloadStatus.total_tracks) * 100 
                 : 0;
             progressBar.style.width = `${percent}%`;
-            progressText.textContent = `Progress: ${downloadStatus.processed_tracks}/${downloadStatus.total_tracks}`;
+            const problems = [];
+            if (downloadStatus.failed_tracks) problems.push(`${downloadStatus.failed_tracks} failed`);
+            if (downloadStatus.skipped_tracks) problems.push(`${downloadStatus.skipped_tracks} skipped`);
+            progressText.textContent = `Progress: ${downloadStatus.processed_tracks}/${downloadStatus.total_tracks}`
+                + (problems.length ? ` (${problems.join(', ')})` : '');
             
             currentTrack.textContent = downloadStatus.current_track || 'Initialize...';
+            const percentText = downloadStatus.current_percent !== null && downloadStatus.current_percent !== undefined
+                ? ` (${downloadStatus.current_percent}%)`
+                : '';
             downloadMethod.textContent = downloadStatus.current_method 
-                ? `Download-Method: ${downloadStatus.current_method}` 
+                ? `Download-Method: ${downloadStatus.current_method}${percentText}` 
                 : '';
         } else {
             statusContainer.innerHTML = '<div class="alert alert-info">No download active. Start a download with the Start button.</div>';
@@ -162,104 +187,112 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
-    function addLogMessage(timestamp, level, message) {
+    function addLogMessage(timestamp, level, message, scroll = true) {
         const li = document.createElement('li');
         li.className = `list-group-item log-item log-${level.toLowerCase()}`;
         li.textContent = `[${timestamp}] ${level}: ${message}`;
         
         logMessages.appendChild(li);
         
-        const logContainer = document.getElementById('log-container');
-        logContainer.scrollTop = logContainer.scrollHeight;
-        
         if (logMessages.children.length > 100) {
             logMessages.removeChild(logMessages.children[0]);
         }
+
+        if (scroll) {
+            scrollLogToBottom();
+        }
+    }
+
+    function scrollLogToBottom() {
+        const logContainer = document.getElementById('log-container');
+        logContainer.scrollTop = logContainer.scrollHeight;
     }
 
     function loadPlaylists() {
         fetch('/api/playlists')
             .then(res => res.json())
-            .then(data => {
-                if (data && data.length > 0) {
-                    playlistList.innerHTML = '';
-                    data.forEach(playlist => {
-                        const li = document.createElement('li');
-                        li.className = 'list-group-item';
-                        
-                        const card = document.createElement('div');
-                        card.className = 'card border-0';
-                        
-                        const row = document.createElement('div');
-                        row.className = 'row g-0';
-                        
-                        const imgCol = document.createElement('div');
-                        imgCol.className = 'col-md-2';
-                        
-                        if (playlist.image) {
-                            const img = document.createElement('img');
-                            img.src = playlist.image;
-                            img.className = 'img-fluid rounded';
-                            img.alt = 'Playlist Cover';
-                            imgCol.appendChild(img);
-                        } else {
-                            const noImg = document.createElement('div');
-                            noImg.className = 'no-image d-flex justify-content-center align-items-center bg-light rounded';
-                            noImg.style.height = '80px';
-                            noImg.innerHTML = '<i class="bi bi-music-note-list"></i>';
-                            imgCol.appendChild(noImg);
-                        }
-                        
-                        const detailsCol = document.createElement('div');
-                        detailsCol.className = 'col-md-8';
-                        
-                        const cardBody = document.createElement('div');
-                        cardBody.className = 'card-body py-1';
-                        
-                        const title = document.createElement('h5');
-                        title.className = 'card-title mb-1';
-                        title.textContent = playlist.name || formatPlaylistUrl(playlist.url || playlist);
-                        
-                        const owner = document.createElement('p');
-                        owner.className = 'card-text small mb-1';
-                        owner.textContent = playlist.owner ? `von ${playlist.owner}` : '';
-                        
-                        const tracks = document.createElement('p');
-                        tracks.className = 'card-text small text-muted';
-                        tracks.textContent = playlist.tracks_total ? `${playlist.tracks_total} Songs` : '';
-                        
-                        cardBody.appendChild(title);
-                        cardBody.appendChild(owner);
-                        cardBody.appendChild(tracks);
-                        detailsCol.appendChild(cardBody);
-                        
-                        const deleteCol = document.createElement('div');
-                        deleteCol.className = 'col-md-2 d-flex align-items-center justify-content-end';
-                        
-                        const deleteBtn = document.createElement('button');
-                        deleteBtn.className = 'btn btn-sm btn-outline-danger delete-btn';
-                        deleteBtn.textContent = 'Remove';
-                        deleteBtn.addEventListener('click', () => deletePlaylist(playlist.url || playlist));
-                        
-                        deleteCol.appendChild(deleteBtn);
-                        
-                        row.appendChild(imgCol);
-                        row.appendChild(detailsCol);
-                        row.appendChild(deleteCol);
-                        card.appendChild(row);
-                        li.appendChild(card);
-                        playlistList.appendChild(li);
-                    });
-                } else {
-                    playlistList.innerHTML = '<li class="list-group-item text-center text-muted">No playlists available</li>';
-                }
-            })
+            .then(renderPlaylists)
             .catch(err => {
                 console.error('Error loading playlists:', err);
                 playlistList.innerHTML = '<li class="list-group-item text-center text-danger">Error loading playlists</li>';
             });
     }
 
+    function renderPlaylists(data) {
+        if (data && data.length > 0) {
+            playlistList.innerHTML = '';
+            data.forEach(playlist => {
+                const li = document.createElement('li');
+                li.className = 'list-group-item';
+                
+                const card = document.createElement('div');
+                card.className = 'card border-0';
+                
+                const row = document.createElement('div');
+                row.className = 'row g-0';
+                
+                const imgCol = document.createElement('div');
+                imgCol.className = 'col-md-2';
+                
+                if (playlist.image) {
+                    const img = document.createElement('img');
+                    img.src = playlist.image;
+                    img.className = 'img-fluid rounded';
+                    img.alt = 'Playlist Cover';
+                    imgCol.appendChild(img);
+                } else {
+                    const noImg = document.createElement('div');
+                    noImg.className = 'no-image d-flex justify-content-center align-items-center bg-light rounded';
+                    noImg.style.height = '80px';
+                    noImg.innerHTML = '<i class="bi bi-music-note-list"></i>';
+                    imgCol.appendChild(noImg);
+                }
+                
+                const detailsCol = document.createElement('div');
+                detailsCol.className = 'col-md-8';
+                
+                const cardBody = document.createElement('div');
+                cardBody.className = 'card-body py-1';
+                
+                const title = document.createElement('h5');
+                title.className = 'card-title mb-1';
+                title.textContent = playlist.name || formatPlaylistUrl(playlist.url || playlist);
+                
+                const owner = document.createElement('p');
+                owner.className = 'card-text small mb-1';
+                owner.textContent = playlist.owner ? `von ${playlist.owner}` : '';
+                
+                const tracks = document.createElement('p');
+                tracks.className = 'card-text small text-muted';
+                tracks.textContent = playlist.tracks_total ? `${playlist.tracks_total} Songs` : '';
+                
+                cardBody.appendChild(title);
+                cardBody.appendChild(owner);
+                cardBody.appendChild(tracks);
+                detailsCol.appendChild(cardBody);
+                
+                const deleteCol = document.createElement('div');
+                deleteCol.className = 'col-md-2 d-flex align-items-center justify-content-end';
+                
+                const deleteBtn = document.createElement('button');
+                deleteBtn.className = 'btn btn-sm btn-outline-danger delete-btn';
+                deleteBtn.textContent = 'Remove';
+                deleteBtn.addEventListener('click', () => deletePlaylist(playlist.url || playlist));
+                
+                deleteCol.appendChild(deleteBtn);
+                
+                row.appendChild(imgCol);
+                row.appendChild(detailsCol);
+                row.appendChild(deleteCol);
+                card.appendChild(row);
+                li.appendChild(card);
+                playlistList.appendChild(li);
+            });
+        } else {
+            playlistList.innerHTML = '<li class="list-group-item text-center text-muted">No playlists available</li>';
+        }
+    }
+
     function deletePlaylist(playlistUrl) {
         fetch('/api/playlists', {
             method: 'DELETE',
@@ -305,8 +338,8 @@ document.addEventListener('DOMContentLoaded', function() {
             .then(res => res.json())
             .then(data => {
                 if (data) {
-                    if (data.downloaded_songs) {
-                        downloadCount.textContent = data.downloaded_songs.length;
+                    if (data.downloaded_count !== undefined) {
+                        downloadCount.textContent = data.downloaded_count;
                     }
                     
                     const recentTracksContainer = document.getElementById('recent-tracks');
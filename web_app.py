@@ -1,175 +1,152 @@
-import os
 import threading
 import time
-from flask import Flask, render_template, request, jsonify
-from flask_socketio import SocketIO
+from collections import deque
+from flask import Flask, Response, render_template, request, jsonify
+from flask_socketio import SocketIO, emit
 from sound_seeker.core import SoundSeeker
+from sound_seeker.control import CancelScope, RunControl
 from sound_seeker.utils import get_cached_env
-from sound_seeker import services
+from sound_seeker.clients import ClientRegistry
+from sound_seeker.metadata import MetadataService
+from sound_seeker.archive import SongArchive
+from sound_seeker.catalog import PlaylistCatalog, PLAYLIST_URL_PREFIX
+from sound_seeker import events, metrics, file_handler
 import logging
 
 app = Flask(__name__, template_folder='web/templates', static_folder='web/static')
 socketio = SocketIO(app, cors_allowed_origins="*")
 
-class SocketLogger(logging.Logger):
-    def __init__(self, name, level=logging.INFO):
-        super().__init__(name, level)
-        self.messages = []
-        
-    def _log(self, level, msg, args, exc_info=None, extra=None, stack_info=False):
-        super()._log(level, msg, args, exc_info, extra, stack_info)
-        log_entry = {
-            'level': logging.getLevelName(level),
-            'message': msg % args if args else msg,
-            'timestamp': time.strftime('%H:%M:%S')
-        }
+class SocketLogHandler(logging.Handler):
+    """Keeps the last `capacity` log entries in a ring buffer and sends new
+    entries to the browsers as one 'log_batch' message per interval.
+
+    emit() only appends to deques, so logging never waits on a socket; the
+    sending happens on a background task that sleeps until records arrive.
+    """
+
+    def __init__(self, capacity=100, interval=0.25, level=logging.INFO):
+        super().__init__(level)
+        self.interval = interval
+        self.messages = deque(maxlen=capacity)
+        # Unbounded: it is emptied every interval, and a burst must not drop lines from the live log.
+        self._pending = deque()
+        self._wake = threading.Event()
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def emit(self, record):
+        try:
+            log_entry = {
+                'level': record.levelname,
+                'message': record.getMessage(),
+                'timestamp': time.strftime('%H:%M:%S', time.localtime(record.created))
+            }
+        except Exception:
+            self.handleError(record)
+            return
         self.messages.append(log_entry)
-        if len(self.messages) > 100:
-            self.messages.pop(0)
-        socketio.emit('log_message', log_entry)
+        self._pending.append(log_entry)
+        if not self._started:
+            self._start()
+        self._wake.set()
+
+    def _start(self):
+        with self._start_lock:
+            if not self._started:
+                self._started = True
+                socketio.start_background_task(self._run)
 
-logger = SocketLogger("SoundSeekerWeb", level=logging.INFO)
+    def _run(self):
+        while True:
+            self._wake.wait()
+            socketio.sleep(self.interval)
+            self._wake.clear()
+            batch = []
+            while self._pending:
+                batch.append(self._pending.popleft())
+            if batch:
+                socketio.emit('log_batch', batch)
+
+    def snapshot(self):
+        return list(self.messages)
+
+logger = logging.Logger("SoundSeekerWeb", level=logging.INFO)
 handler = logging.StreamHandler()
 formatter = logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s', datefmt='%H:%M:%S')
 handler.setFormatter(formatter)
 logger.addHandler(handler)
+log_handler = SocketLogHandler()
+logger.addHandler(log_handler)
 
 downloader = None
 download_thread = None
-stop_event = threading.Event()
-pause_event = threading.Event()
-skip_event = threading.Event()
+control = RunControl()
 download_status = {
     'running': False,
     'paused': False,
     'total_tracks': 0,
     'processed_tracks': 0,
+    'failed_tracks': 0,
+    'skipped_tracks': 0,
     'current_track': '',
-    'current_method': ''
+    'current_method': '',
+    'current_percent': None
 }
+status_broadcaster = None
+cleanup_thread = None
+cleanup_scope = None
 
 last_update_time = 0
 
-track_info_cache = {}
-playlist_info_cache = {}
+clients = None
+metadata = None
+catalog = None
+archive = None
 
-def get_track_info_cached(track_id, client_id, client_secret, logger):
-    """Cached version of track info retrieval"""
-    global track_info_cache
-    
-    if track_id in track_info_cache:
-        return track_info_cache[track_id]
-    
-    try:
-        track_info = services.get_track_info(track_id, client_id, client_secret, logger)
-        if track_info:
-            track_info_cache[track_id] = track_info
-        return track_info
-    except Exception as e:
-        logger.error(f"Error getting track info: {e}")
-        return None
+def get_clients():
+    global clients
+    if clients is None:
+        clients = ClientRegistry(get_cached_env(logger), logger)
+    return clients
+
+def get_metadata():
+    global metadata
+    if metadata is None:
+        metadata = MetadataService.from_env(get_clients(), get_cached_env(logger), logger)
+    return metadata
+
+def get_catalog():
+    global catalog
+    if catalog is None:
+        catalog = PlaylistCatalog.from_env(get_cached_env(logger), get_metadata(), logger,
+                                           on_change=lambda playlists: socketio.emit('playlists_update', playlists))
+    return catalog
 
 def get_playlists():
     try:
-        env = get_cached_env(logger)
-
-        file_path = os.path.join(env["SPOTIFY_PLAYLISTS_PATH"], 'playlists.txt')
-        with open(file_path, "r") as f:
-            playlist_urls = [line.strip() for line in f if line.strip().startswith("https://open.spotify.com/")]
-        
-        from sound_seeker.services import get_playlist_info
-        playlists_with_details = []
-        
-        for url in playlist_urls:
-            playlist_id = url.split('/')[-1].split('?')[0]
-            try:
-                info = get_playlist_info(
-                    playlist_id, 
-                    env['SPOTIFY_CLIENT_ID'], 
-                    env['SPOTIFY_CLIENT_SECRET'], 
-                    logger
-                )
-                if info:
-                    info['url'] = url
-                    playlists_with_details.append(info)
-                else:
-                    playlists_with_details.append({
-                        'id': playlist_id,
-                        'name': f"Playlist {playlist_id}",
-                        'tracks_total': 0,
-                        'image': '',
-                        'owner': '',
-                        'url': url
-                    })
-            except Exception as e:
-                logger.error(f"Error fetching details for playlist {playlist_id}: {e}")
-                playlists_with_details.append({
-                    'id': playlist_id,
-                    'name': f"Playlist {playlist_id}",
-                    'tracks_total': 0,
-                    'image': '',
-                    'owner': '',
-                    'url': url
-                })
-        
-        return playlists_with_details
+        return get_catalog().list()
     except Exception as e:
         logger.error(f"Error reading playlists: {e}")
         return []
 
-def save_playlists(playlists):
-    try:
-        env = get_cached_env(logger)
-        file_path = os.path.join(env["SPOTIFY_PLAYLISTS_PATH"], 'playlists.txt')
-        with open(file_path, "w") as f:
-            for playlist in playlists:
-                url = playlist if isinstance(playlist, str) else playlist.get('url', '')
-                if url:
-                    f.write(f"{url}\n")
-        return True
-    except Exception as e:
-        logger.error(f"Error saving playlists: {e}")
-        return False
+def get_archive():
+    global archive
+    if archive is None:
+        archive = SongArchive.from_env(get_cached_env(logger), logger)
+    return archive
 
-def get_downloaded_songs():
+def get_downloaded_songs(offset=0, limit=100):
     try:
-        env = get_cached_env(logger)
-        song_archive_path = os.path.join(env["SONG_ARCHIVE_DIR"], "songarchive.log")
-        downloaded_songs = []
-        
-        if os.path.exists(song_archive_path):
-            with open(song_archive_path, "r") as f:
-                track_ids = [line.strip() for line in f if line.strip()]
-            downloaded_songs = [{'id': track_id} for track_id in track_ids]
-        
-        return downloaded_songs
+        return [{'id': entry['track_id'], 'path': entry['path'], 'source': entry['source'], 'added_at': entry['added_at']}
+                for entry in get_archive().list(offset=offset, limit=limit)]
     except Exception as e:
         logger.error(f"Error getting downloaded songs: {e}")
         return []
     
 def get_recent_downloads(limit=5):
     try:
-        env = get_cached_env(logger)
-        song_archive_path = os.path.join(env["SONG_ARCHIVE_DIR"], "songarchive.log")
-        recent_tracks = []
-        
-        if os.path.exists(song_archive_path):
-            with open(song_archive_path, "r") as f:
-                all_lines = f.readlines()
-                track_ids = [line.strip() for line in all_lines[-limit:] if line.strip()]
-            
-            if track_ids:                
-                for track_id in reversed(track_ids):
-                    track_info = get_track_info_cached(
-                        track_id, 
-                        env['SPOTIFY_CLIENT_ID'], 
-                        env['SPOTIFY_CLIENT_SECRET'], 
-                        logger
-                    )
-                    if track_info:
-                        recent_tracks.append(track_info)
-        
-        return recent_tracks
+        track_ids = [entry['track_id'] for entry in get_archive().recent(limit)]
+        return get_metadata().get_tracks(track_ids) if track_ids else []
     except Exception as e:
         logger.error(f"Error getting recent downloads: {e}")
         return []
@@ -182,83 +159,83 @@ def emit_update_recent_downloads():
         socketio.emit('update_recent_downloads')
         last_update_time = current_time
 
-def download_worker():
-    global downloader, download_status
-    
-    
-    downloader.stop_event = stop_event
-    downloader.pause_event = pause_event
-    downloader.skip_event = skip_event
-    
-    original_info = downloader.logger.info
-    original_warning = downloader.logger.warning
-    original_error = downloader.logger.error
-    
-    def patched_info(msg, *args, **kwargs):
-        original_info(msg, *args, **kwargs)
-        if "Processing" in msg and ":" in msg:
-            try:
-                parts = msg.split(":")
-                track_info = parts[1].strip()
-                download_status['current_track'] = track_info
-                socketio.emit('status_update', download_status)
-            except:
-                pass
-        elif "NZB found:" in msg:
-            download_status['current_method'] = 'Usenet'
-            socketio.emit('status_update', download_status)
-        elif "Downloading with SpotDL:" in msg:
-            download_status['current_method'] = 'SpotDL'
-            socketio.emit('status_update', download_status)
-        elif "Successfully downloaded with NZB" in msg:
-            download_status['processed_tracks'] += 1
-            socketio.emit('status_update', download_status)
-            emit_update_recent_downloads()
-        elif "Successfully downloaded" in msg or "Track already in archive" in msg:
-            download_status['processed_tracks'] += 1
-            socketio.emit('status_update', download_status)
+METHOD_LABELS = {'usenet': 'Usenet', 'spotdl': 'SpotDL', 'archive': 'Archive'}
+
+class StatusBroadcaster:
+    """Folds progress events into download_status and emits only the changed
+    fields as a single 'status_delta' message per interval."""
+
+    def __init__(self, status, interval=0.5):
+        self.status = status
+        self.interval = interval
+        self._delta = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def _schedule(self):
+        if self._delta and self._timer is None:
+            self._timer = threading.Timer(self.interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def update(self, **fields):
+        with self._lock:
+            for key, value in fields.items():
+                if self.status.get(key) != value:
+                    self.status[key] = value
+                    self._delta[key] = value
+            self._schedule()
+
+    def increment(self, *keys):
+        with self._lock:
+            for key in keys:
+                self.status[key] = self.status.get(key, 0) + 1
+                self._delta[key] = self.status[key]
+            self._schedule()
+
+    def handle_event(self, event):
+        if event.kind == events.TRACK_STARTED:
+            self.update(current_track=event.label, current_method='', current_percent=None)
+        elif event.kind == events.METHOD_CHOSEN:
+            self.update(current_method=METHOD_LABELS.get(event.method, event.method))
+        elif event.kind == events.TRACK_PROGRESS:
+            self.update(current_percent=event.percent)
+        elif event.kind == events.TRACK_COMPLETED:
+            self.increment('processed_tracks')
             emit_update_recent_downloads()
-        elif msg.startswith("SpotDL:"):
-            download_status['current_track'] += f"\n{msg[8:]}"
-            socketio.emit('status_update', download_status)
+        elif event.kind == events.TRACK_FAILED:
+            self.increment('processed_tracks', 'failed_tracks')
+        elif event.kind == events.TRACK_SKIPPED:
+            self.increment('processed_tracks', 'skipped_tracks')
 
-    def patched_warning(msg, *args, **kwargs):
-        original_warning(msg, *args, **kwargs)
-        if "Song file not found at expected path:" in msg:
-            download_status['processed_tracks'] += 1
-            socketio.emit('status_update', download_status)
+    def flush(self):
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+            delta, self._delta, self._timer = self._delta, {}, None
+        if delta:
+            socketio.emit('status_delta', delta)
 
-    downloader.logger.info = patched_info
-    downloader.logger.warning = patched_warning
-    downloader.logger.error = original_error
+def download_worker(broadcaster):
+    global downloader, download_status
+    
+    downloader.events.subscribe(broadcaster.handle_event)
     
     try:
-        downloader.remove_empty_folders()
-        
-        file_path = os.path.join(downloader.env["SPOTIFY_PLAYLISTS_PATH"], 'playlists.txt')
-        with open(file_path, "r") as f:
-            playlists = [line.strip() for line in f if line.strip().startswith("https://open.spotify.com/")]
-        
-        total_tracks = 0
-        for playlist_url in playlists:
-            playlist_id = playlist_url.split('/')[-1].split('?')[0]
-            playlist_name, tracks = services.find_playlist_tracks(
-                playlist_id, 
-                downloader.env['SPOTIFY_CLIENT_ID'],
-                downloader.env['SPOTIFY_CLIENT_SECRET'],
-                logger
-            )
-            if tracks:
-                total_tracks += len(tracks)
-        
-        download_status['total_tracks'] = total_tracks
-        socketio.emit('status_update', download_status)
+        plans = downloader.plan_playlists()
+        queue = downloader.build_work_queue(plans)
+        broadcaster.update(total_tracks=len(queue))
         
-        downloader.download_each_playlist()
+        downloader.download_each_playlist(plans, queue)
         logger.info("All downloads completed successfully")
     except Exception as e:
         logger.error(f"Error in download thread: {e}")
     finally:
+        downloader.close()
+        logger.info("Totals since the web app started:")
+        for line in metrics.summary_lines():
+            logger.info(line)
+        broadcaster.flush()
         download_status['running'] = False
         download_status['paused'] = False
         socketio.emit('status_update', download_status)
@@ -275,14 +252,17 @@ def api_get_playlists():
 @app.route('/api/playlists', methods=['POST'])
 def api_add_playlist():
     data = request.json
-    playlists = get_playlists()
     
     if data and 'playlist_url' in data:
         playlist_url = data['playlist_url'].strip()
-        if playlist_url.startswith("https://open.spotify.com/") and playlist_url not in playlists:
-            playlists.append(playlist_url)
-            if save_playlists(playlists):
-                return jsonify({"success": True, "playlists": playlists})
+        if playlist_url.startswith(PLAYLIST_URL_PREFIX):
+            try:
+                if not get_catalog().add(playlist_url):
+                    return jsonify({"success": False, "message": "Playlist already added"}), 400
+                return jsonify({"success": True, "playlists": get_playlists()})
+            except OSError as e:
+                logger.error(f"Error saving playlists: {e}")
+                return jsonify({"success": False, "message": "Could not save playlists"}), 500
     
     return jsonify({"success": False, "message": "Invalid playlist URL"}), 400
 
@@ -296,69 +276,65 @@ def api_skip_song():
     if download_status['paused']:
         return jsonify({"success": False, "message": "Download is paused. Resume first."}), 400
     
-    skip_event.set()
+    control.skip()
     logger.info("Skipping current track")
     return jsonify({"success": True, "message": "Track skipped"})
 
 @app.route('/api/playlists', methods=['DELETE'])
 def api_remove_playlist():
     data = request.json
-    playlist_objects = get_playlists()
     
     if data and 'playlist_url' in data:
-        playlist_url = data['playlist_url']
-        
-        playlist_urls = []
-        found = False
-        
-        for playlist in playlist_objects:
-            current_url = playlist.get('url') if isinstance(playlist, dict) else playlist
-            
-            if current_url != playlist_url:
-                playlist_urls.append(current_url)
-            else:
-                found = True
-        
-        if found and save_playlists(playlist_urls):
-            return jsonify({"success": True})
+        try:
+            if get_catalog().remove(data['playlist_url']):
+                return jsonify({"success": True})
+        except OSError as e:
+            logger.error(f"Error saving playlists: {e}")
+            return jsonify({"success": False, "message": "Could not save playlists"}), 500
         
     return jsonify({"success": False, "message": "Playlist not found"}), 404
 
 @app.route('/api/downloads', methods=['GET'])
 def api_get_downloads():
+    offset = request.args.get('offset', 0, type=int)
+    limit = min(request.args.get('limit', 100, type=int), 1000)
     return jsonify({
         "status": download_status,
-        "downloaded_songs": get_downloaded_songs(),
+        "downloaded_count": get_archive().count(),
+        "downloaded_songs": get_downloaded_songs(offset, limit),
         "recent_tracks": get_recent_downloads(5)
     })
 
 @app.route('/api/downloads/start', methods=['POST'])
 def api_start_download():
-    global downloader, download_thread, download_status
+    global downloader, download_thread, download_status, control, status_broadcaster
     
     if download_status['running']:
         if download_status['paused']:
-            pause_event.clear()
+            control.resume()
             download_status['paused'] = False
             socketio.emit('status_update', download_status)
             logger.info("Download resumed")
             return jsonify({"success": True, "message": "Download resumed"})
         return jsonify({"success": False, "message": "Download already running"}), 400
     
+    stop_cleanup()
     download_status = {
         'running': True,
         'paused': False,
         'total_tracks': 0,
         'processed_tracks': 0,
+        'failed_tracks': 0,
+        'skipped_tracks': 0,
         'current_track': 'Initializing...',
-        'current_method': ''
+        'current_method': '',
+        'current_percent': None
     }
+    status_broadcaster = StatusBroadcaster(download_status)
     
-    stop_event.clear()
-    pause_event.clear()
-    
-    downloader = SoundSeeker(logger=logger)
-    download_thread = threading.Thread(target=download_worker)
+    control = RunControl()
+    downloader = SoundSeeker(logger=logger, clients=get_clients(), control=control)
+    download_thread = threading.Thread(target=download_worker, args=(status_broadcaster,))
     download_thread.daemon = True
     download_thread.start()
     
@@ -376,7 +352,7 @@ def api_pause_download():
     if download_status['paused']:
         return jsonify({"success": False, "message": "Download already paused"}), 400
     
-    pause_event.set()
+    control.pause()
     download_status['paused'] = True
     socketio.emit('status_update', download_status)
     logger.info("Download paused")
@@ -389,23 +365,54 @@ def api_stop_download():
     if not download_status['running']:
         return jsonify({"success": False, "message": "No download running"}), 400
     
-    stop_event.set()
-    pause_event.clear()
+    control.stop()
     download_status['running'] = False
     download_status['paused'] = False
     socketio.emit('status_update', download_status)
     logger.info("Download stopped")
     return jsonify({"success": True, "message": "Download stopped"})
 
+def cleanup_worker(scope):
+    env = get_cached_env(logger)
+    logger.info("Removing empty folders in the clean directory...")
+    try:
+        file_handler.remove_empty_folders(env['CLEAN_DIR'], logger, rate=env['FOLDER_CLEANUP_RATE'], cancel_scope=scope)
+    except Exception as e:
+        logger.error(f"Error in folder cleanup: {e}")
+
+def stop_cleanup():
+    """Cancels a running folder cleanup, so it does not race a download creating folders."""
+    if cleanup_thread and cleanup_thread.is_alive():
+        cleanup_scope.cancel()
+        cleanup_thread.join(timeout=5)
+
+@app.route('/api/maintenance/empty-folders', methods=['POST'])
+def api_remove_empty_folders():
+    global cleanup_thread, cleanup_scope
+    
+    if download_status['running']:
+        return jsonify({"success": False, "message": "Download is running"}), 400
+    
+    if cleanup_thread and cleanup_thread.is_alive():
+        return jsonify({"success": False, "message": "Folder cleanup already running"}), 400
+    
+    cleanup_scope = CancelScope("Empty folder cleanup")
+    cleanup_thread = threading.Thread(target=cleanup_worker, args=(cleanup_scope,), daemon=True)
+    cleanup_thread.start()
+    return jsonify({"success": True, "message": "Folder cleanup started"})
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/logs', methods=['GET'])
 def api_get_logs():
-    return jsonify(logger.messages)
+    return jsonify(log_handler.snapshot())
 
 @socketio.on('connect')
 def handle_connect():
-    socketio.emit('status_update', download_status)
-    for msg in logger.messages:
-        socketio.emit('log_message', msg)
+    emit('status_update', download_status)
+    emit('log_backlog', log_handler.snapshot())
 
 if __name__ == '__main__':
     socketio.run(app, host='0.0.0.0', port=5000, debug=True, allow_unsafe_werkzeug=True)
\ No newline at end of file